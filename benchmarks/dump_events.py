@@ -0,0 +1,67 @@
+""" Pagination and prefetching in dump_events.py, against local Snuba and nodestore
+
+Usage:
+
+    python -m benchmarks.dump_events --max-events 20000
+
+Runs without sentry. Compares offset pagination, which scans all previous
+pages again for every page, with keyset pagination, and checks that every
+event ends up in the output exactly once.
+"""
+import io
+import time
+from typing import Iterator, List
+
+import click
+
+from grouping_tests.fetch import copy_events, iter_pages
+from benchmarks.standins import LocalNodestore, LocalSnuba, generate_node_id
+
+
+@click.command()
+@click.option("--max-events", type=int, default=20000, show_default=True)
+@click.option("--num-groups", type=int, help="Defaults to --max-events + 1 page")
+@click.option("--batch-size", type=int, default=200, show_default=True)
+@click.option("--network-threads", type=int, default=64, show_default=True)
+@click.option("--snuba-latency", type=float, default=20.0, show_default=True,
+              help="Simulated Snuba latency per query [ms]")
+@click.option("--nodestore-latency", type=float, default=5.0, show_default=True,
+              help="Simulated nodestore latency per event [ms]")
+def dump_events(max_events: int, num_groups: int, batch_size: int, network_threads: int,
+                snuba_latency: float, nodestore_latency: float):
+    """ Dump synthetic events with offset and keyset pagination """
+    snuba = LocalSnuba(num_groups or max_events + batch_size, snuba_latency / 1000)
+    nodestore = LocalNodestore(nodestore_latency / 1000, 0)
+
+    def load(event_id):
+        return nodestore.get_bytes(generate_node_id("1", event_id)).rstrip(b"\n")
+
+    print(f"{'pagination':>10} {'time [s]':>9} {'events':>7} {'unique':>7}")
+    for name, pages in [
+        ("offset", offset_pages(snuba, max_events, batch_size)),
+        ("keyset", iter_pages(snuba.fetch_page, max_events, batch_size)),
+    ]:
+        output = io.BytesIO()
+        t0 = time.perf_counter()
+        for _ in copy_events(pages, load, lambda raw: output.write(raw + b"\n"),
+                             network_threads):
+            pass
+        elapsed = time.perf_counter() - t0
+
+        events = output.getvalue().splitlines()
+        print(f"{name:>10} {elapsed:>9.2f} {len(events):>7} {len(set(events)):>7}")
+
+
+def offset_pages(snuba: LocalSnuba, max_events: int, page_size: int) -> Iterator[List[str]]:
+    """ Pagination like dump_events.py used to do it """
+    num_events = 0
+    while num_events < max_events:
+        rows = snuba.fetch_page_at_offset(num_events, min(page_size, max_events - num_events))
+        if not rows:
+            return
+        num_events += len(rows)
+        yield [row['last_event_id'] for row in rows]
+
+
+if __name__ == "__main__":
+    dump_events()  # pylint: disable=no-value-for-parameter
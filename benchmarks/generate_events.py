@@ -0,0 +1,63 @@
+""" Write a synthetic event corpus in the layout of store_events.py
+
+Usage:
+
+    python -m benchmarks.generate_events --output-dir ./events --num-events 100000
+
+Runs without sentry. The result can be passed to create_grouping_report.py
+via --event-dir. See grouping_tests.synthetic for what the events look like.
+"""
+from pathlib import Path
+from typing import Optional, Tuple
+
+import click
+
+from grouping_tests.corpus import CorpusWriter
+from grouping_tests.fetch import EventWriter
+from grouping_tests.synthetic import PLATFORMS, EventGenerator
+
+
+@click.command()
+@click.option("--output-dir", required=True, type=Path)
+@click.option("--num-projects", type=int, default=1, show_default=True)
+@click.option("--num-events", type=int, default=10000, show_default=True,
+              help="Events per project")
+@click.option("--num-groups", type=int, default=1000, show_default=True,
+              help="Groups per project")
+@click.option("--platform", "platforms", type=click.Choice(PLATFORMS), multiple=True,
+              default=PLATFORMS, show_default=True)
+@click.option("--num-frames", type=int, default=20, show_default=True)
+@click.option("--num-threads", type=int, default=1, show_default=True)
+@click.option("--chain-depth", type=int, default=1, show_default=True,
+              help="Number of chained exceptions per event")
+@click.option("--fan-out", type=int, default=4, show_default=True,
+              help="Alternatives per stack frame, i.e. fan-out of hierarchical grouping")
+@click.option("--seed", type=int, default=0, show_default=True)
+@click.option("--segment-size", type=int,
+              help="Write a compressed corpus in segments of this many MB, see store_events.py")
+def generate_events(output_dir: Path, num_projects: int, num_events: int, num_groups: int,
+                    platforms: Tuple[str, ...], num_frames: int, num_threads: int,
+                    chain_depth: int, fan_out: int, seed: int, segment_size: Optional[int]):
+    """ Write synthetic events """
+    write_events(output_dir, num_projects, num_events, segment_size, EventGenerator(
+        num_groups, platforms, num_frames, num_threads, chain_depth, fan_out, seed))
+
+
+def write_events(output_dir: Path, num_projects: int, num_events: int,
+                 segment_size: Optional[int], generator: EventGenerator):
+    if segment_size:
+        writer = CorpusWriter(output_dir, segment_size * 1024 * 1024)
+    else:
+        writer = EventWriter(output_dir)
+
+    with click.progressbar(length=num_projects * num_events) as progress_bar:
+        for project_id in range(1, num_projects + 1):
+            for _, event in generator.events(str(project_id), num_events):
+                writer(str(project_id), event['event_id'], event)
+                progress_bar.update(1)
+
+    writer.close()
+
+
+if __name__ == "__main__":
+    generate_events()  # pylint: disable=no-value-for-parameter
@@ -0,0 +1,221 @@
+""" Local stand-ins for sentry services, to benchmark scripts without a sentry installation """
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import bisect
+import datetime
+import hashlib
+import json
+import random
+import sqlite3
+import threading
+import time
+
+from grouping_tests.upload import Sender
+
+
+class LocalNodestore:
+
+    """ Serves synthetic event payloads with a simulated per-request latency
+
+    Mimics ``get`` and ``get_multi`` of sentry's nodestore. Latency is spent
+    sleeping, which releases the GIL like waiting for a real backend does.
+    """
+
+    def __init__(self, latency: float = 0.005, latency_per_item: float = 0.0001,
+                 missing_rate: float = 0.0):
+        self._latency = latency  # seconds per request
+        self._latency_per_item = latency_per_item  # seconds per requested node
+        self._missing_rate = missing_rate  # fraction of nodes that do not exist
+
+    def get(self, node_id: str) -> Optional[Dict[str, Any]]:
+        return self.get_multi([node_id]).get(node_id)
+
+    def get_multi(self, node_ids: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        node_ids = list(node_ids)
+        time.sleep(self._latency + self._latency_per_item * len(node_ids))
+
+        return {
+            node_id: self._payload(node_id) for node_id in node_ids
+            if not self._is_missing(node_id)
+        }
+
+    def get_bytes(self, node_id: str) -> Optional[bytes]:
+        """ Raw payload, like nodestore.backend._get_bytes """
+        payload = self.get(node_id)
+
+        return None if payload is None else json.dumps(payload).encode() + b"\n"
+
+    def _is_missing(self, node_id: str) -> bool:
+        digest = hashlib.md5(node_id.encode()).digest()
+
+        return int.from_bytes(digest[:4], 'big') < self._missing_rate * 2**32
+
+    @staticmethod
+    def _payload(node_id: str) -> Dict[str, Any]:
+        return {
+            'event_id': hashlib.md5(node_id.encode()).hexdigest(),
+            'platform': 'python',
+            'message': f"Synthetic event {node_id}",
+            'exception': {'values': [{
+                'type': 'ValueError',
+                'value': 'synthetic',
+                'stacktrace': {'frames': [
+                    {'function': f"func_{i}", 'module': 'app.synthetic', 'lineno': i}
+                    for i in range(20)
+                ]},
+            }]},
+        }
+
+
+class LocalSnuba:
+
+    """ Serves pages of (last_timestamp, last_event_id) rows like dump_events.py queries them
+
+    Rows are ordered by descending timestamp, then event ID. Pages either
+    follow a cursor (keyset pagination) or skip an offset. With an offset, all
+    skipped rows are scanned again, like a database has to.
+    """
+
+    def __init__(self, num_groups: int, latency: float = 0.02,
+                 latency_per_row: float = 0.00001, seed: int = 0):
+        rng = random.Random(seed)
+        now = datetime.datetime(2021, 3, 1)
+        # Coarse timestamps, so the event ID has to break ties
+        num_minutes = num_groups // 10 + 1
+        self._rows = sorted((
+            {
+                'last_timestamp': now - datetime.timedelta(minutes=rng.randrange(num_minutes)),
+                'last_event_id': f"{rng.getrandbits(128):032x}",
+            }
+            for _ in range(num_groups)
+        ), key=_sort_key)
+        self._keys = [_sort_key(row) for row in self._rows]
+        self._latency = latency  # seconds per query
+        self._latency_per_row = latency_per_row  # seconds per scanned row
+
+    def fetch_page(self, cursor: Optional[Tuple[Any, str]], limit: int) -> List[Dict[str, Any]]:
+        start = 0 if cursor is None else bisect.bisect_right(self._keys, _sort_key({
+            'last_timestamp': cursor[0], 'last_event_id': cursor[1]}))
+
+        return self._scan(start, limit, num_scanned=limit)
+
+    def fetch_page_at_offset(self, offset: int, limit: int) -> List[Dict[str, Any]]:
+        return self._scan(offset, limit, num_scanned=offset + limit)
+
+    def _scan(self, start: int, limit: int, num_scanned: int) -> List[Dict[str, Any]]:
+        time.sleep(self._latency + self._latency_per_row * num_scanned)
+
+        return self._rows[start:start + limit]
+
+
+class LocalRelay(Sender):
+
+    """ Accepts envelopes up to a rate limit, like a Relay with a quota
+
+    Above the rate limit, it answers 429 and
+    rejects everything for ``retry_after`` seconds, like Relay does.
+    """
+
+    def __init__(self, events_per_second: float, latency: float = 0.01,
+                 retry_after: float = 1.0):
+        self._events_per_second = events_per_second
+        self._latency = latency  # seconds per request
+        self._retry_after = retry_after
+        self._window_start = time.monotonic()
+        self._window_count = 0
+        self._disabled_until = 0.0
+        self._lock = threading.Lock()
+        self.num_accepted = 0
+
+    def send(self, body: bytes) -> int:  # pylint: disable=unused-argument
+        time.sleep(self._latency)
+        with self._lock:
+            now = time.monotonic()
+            if now < self._disabled_until:
+                return 429
+
+            if now - self._window_start >= 1:
+                self._window_start = now
+                self._window_count = 0
+            self._window_count += 1
+            if self._window_count > self._events_per_second:
+                self._disabled_until = now + self._retry_after
+                return 429
+
+            self.num_accepted += 1
+            return 200
+
+    def retry_after(self) -> float:
+        return max(0.0, self._disabled_until - time.monotonic())
+
+
+class LocalGroupDatabase:
+
+    """ A sqlite database of groups with related rows, like wipe_project.py deletes them
+
+    Every thread gets a connection of its own, like Django does. Deleting a
+    group also deletes its related rows and sleeps for ``latency``, which
+    stands in for the queries sentry's ``delete_group`` runs.
+    """
+
+    def __init__(self, path: str, latency: float = 0.002):
+        self._path = path
+        self._latency = latency  # seconds per deleted group
+        self._local = threading.local()
+
+    def populate(self, project_id: int, num_groups: int, rows_per_group: int = 5):
+        connection = self._connection()
+        connection.executescript("""
+            DROP TABLE IF EXISTS groups;
+            DROP TABLE IF EXISTS group_rows;
+            CREATE TABLE groups (id INTEGER PRIMARY KEY, project_id INTEGER);
+            CREATE TABLE group_rows (id INTEGER PRIMARY KEY, group_id INTEGER);
+            CREATE INDEX group_rows_group_id ON group_rows (group_id);
+        """)
+        with connection:
+            connection.executemany("INSERT INTO groups (id, project_id) VALUES (?, ?)", (
+                (group_id, project_id) for group_id in range(1, num_groups + 1)))
+            connection.executemany("INSERT INTO group_rows (group_id) VALUES (?)", (
+                (group_id, ) for group_id in range(1, num_groups + 1)
+                for _ in range(rows_per_group)))
+
+    def count(self, project_id: int) -> int:
+        return self._connection().execute(
+            "SELECT COUNT(*) FROM groups WHERE project_id = ?", (project_id, )).fetchone()[0]
+
+    def fetch_ids(self, project_id: int, after_id: int, limit: int) -> List[int]:
+        return [row[0] for row in self._connection().execute(
+            "SELECT id FROM groups WHERE project_id = ? AND id > ? ORDER BY id LIMIT ?",
+            (project_id, after_id, limit))]
+
+    def delete_ids(self, group_ids: List[int]) -> int:
+        connection = self._connection()
+        num_deleted = 0
+        for group_id in group_ids:
+            time.sleep(self._latency)
+            with connection:
+                connection.execute("DELETE FROM group_rows WHERE group_id = ?", (group_id, ))
+                num_deleted += connection.execute(
+                    "DELETE FROM groups WHERE id = ?", (group_id, )).rowcount
+
+        return num_deleted
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._local.connection = sqlite3.connect(self._path, timeout=60)
+
+        return connection
+
+
+def _sort_key(row: Dict[str, Any]):
+    """ Descending by timestamp, then by event ID """
+    return -row['last_timestamp'].timestamp(), _negate_hex(row['last_event_id'])
+
+
+def _negate_hex(value: str) -> str:
+    return value.translate(str.maketrans("0123456789abcdef", "fedcba9876543210"))
+
+
+def generate_node_id(project_id: str, event_id: str) -> str:
+    """ Same scheme as sentry's Event.generate_node_id """
+    return hashlib.md5(f"{project_id}:{event_id}".encode()).hexdigest()
@@ -0,0 +1,47 @@
+""" Throughput of the fetch engine behind store_events.py, against a local nodestore
+
+Usage:
+
+    python -m benchmarks.store_events --num-events 20000 --batch-size 1 --batch-size 100
+
+Runs without sentry. Compare batch sizes and numbers of threads to see how
+well per-request latency is amortized.
+"""
+import tempfile
+from pathlib import Path
+from typing import Tuple
+
+import click
+
+from grouping_tests.fetch import EventWriter, fetch_events, nodestore_fetcher
+from benchmarks.standins import LocalNodestore, generate_node_id
+
+
+@click.command()
+@click.option("--num-events", type=int, default=20000, show_default=True)
+@click.option("--num-projects", type=int, default=10, show_default=True)
+@click.option("--batch-size", "batch_sizes", type=int, multiple=True, default=[1, 10, 100],
+              show_default=True)
+@click.option("--num-workers", type=int, default=16, show_default=True)
+@click.option("--latency", type=float, default=5.0, show_default=True,
+              help="Simulated nodestore latency per request [ms]")
+@click.option("--latency-per-item", type=float, default=0.1, show_default=True,
+              help="Simulated nodestore latency per requested event [ms]")
+def store_events(num_events: int, num_projects: int, batch_sizes: Tuple[int, ...],
+                 num_workers: int, latency: float, latency_per_item: float):
+    """ Fetch and write synthetic events for each batch size """
+    nodestore = LocalNodestore(latency / 1000, latency_per_item / 1000)
+    fetch_batch = nodestore_fetcher(nodestore, generate_node_id)
+    keys = [(str(i % num_projects + 1), f"{i:032x}") for i in range(num_events)]
+
+    print(f"{'batch size':>10} {'time [s]':>9} {'events / s':>11}")
+    for batch_size in batch_sizes:
+        with tempfile.TemporaryDirectory() as output_dir:
+            stats = fetch_events(
+                keys, fetch_batch, EventWriter(Path(output_dir)), batch_size, num_workers)
+        rate = stats.num_stored / stats.elapsed
+        print(f"{batch_size:>10} {stats.elapsed:>9.2f} {rate:>11.0f}")
+
+
+if __name__ == "__main__":
+    store_events()  # pylint: disable=no-value-for-parameter
@@ -0,0 +1,280 @@
+""" Benchmark suite for the report pipeline, compared against a stored baseline
+
+Usage:
+
+    python -m benchmarks.suite --save-baseline  # before a change
+    python -m benchmarks.suite                  # after it
+
+Stages:
+
+    generate             write a synthetic corpus, see benchmarks.generate_events
+    insert flat          insert --num-insert events into a flat issue tree
+    insert hierarchical  insert --num-insert events into a hierarchical issue tree
+    render               write the HTML report of a project with --num-events events
+    report               run create_grouping_report.py on the synthetic corpus
+
+Every stage runs --repeat times and the fastest run counts. The suite fails
+if a stage is more than --threshold slower than in the baseline, which is
+only compared if it was measured with the same parameters. Save the
+baseline on the machine you compare on. ``render`` and ``report`` need
+sentry and are skipped without it.
+"""
+import hashlib
+import importlib.util
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from functools import lru_cache
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import click
+
+from benchmarks.generate_events import write_events
+from grouping_tests.groups.base import GroupNode, HashData
+from grouping_tests.groups.records import RecordStore
+from grouping_tests.synthetic import EventGenerator
+
+REPO_DIR = Path(__file__).parent.parent
+
+STAGES = ("generate", "insert flat", "insert hierarchical", "render", "report")
+
+#: Stages which import sentry
+SENTRY_STAGES = ("render", "report")
+
+
+class Workload:
+
+    """ Inputs shared by the stages, created on first use """
+
+    def __init__(self, tmp_dir: Path, params: dict):
+        self.tmp_dir = tmp_dir
+        self.params = params
+        self.generator = EventGenerator(
+            num_groups=params['num_groups'], num_frames=params['num_frames'],
+            fan_out=params['fan_out'], seed=params['seed'])
+        self._num_dirs = 0
+        self._hashes: Optional[List[Tuple[List[HashData], List[HashData]]]] = None
+        self._event_dir: Optional[Path] = None
+
+    def new_dir(self, prefix: str) -> Path:
+        self._num_dirs += 1
+        return self.tmp_dir / f"{prefix}_{self._num_dirs}"
+
+    def hashes(self) -> List[Tuple[List[HashData], List[HashData]]]:
+        if self._hashes is None:
+            rng = random.Random(self.params['seed'])
+            self._hashes = [
+                self.generator.group_hashes(self.generator.pick_group(rng))
+                for _ in range(self.params['num_insert'])
+            ]
+
+        return self._hashes
+
+    def event_dir(self) -> Path:
+        if self._event_dir is None:
+            self._event_dir = self.tmp_dir / "events"
+            write_events(self._event_dir, 1, self.params['num_events'], None, self.generator)
+
+        return self._event_dir
+
+
+@click.command()
+@click.option("--stage", "stages", type=click.Choice(STAGES), multiple=True, default=STAGES,
+              show_default=True)
+@click.option("--num-events", type=int, default=20000, show_default=True,
+              help="Events of the synthetic corpus")
+@click.option("--num-insert", type=int, default=1000000, show_default=True,
+              help="Events inserted into issue trees")
+@click.option("--num-groups", type=int, default=10000, show_default=True)
+@click.option("--num-frames", type=int, default=20, show_default=True)
+@click.option("--fan-out", type=int, default=4, show_default=True)
+@click.option("--num-workers", type=int, default=4, show_default=True,
+              help="Passed to create_grouping_report.py")
+@click.option("--grouping-config", default="newstyle:2019-10-29", show_default=True,
+              help="ID of the grouping config used by create_grouping_report.py")
+@click.option("--seed", type=int, default=0, show_default=True)
+@click.option("--repeat", type=int, default=3, show_default=True)
+@click.option("--baseline", type=Path, default=Path(__file__).parent / "baseline.json",
+              show_default=True)
+@click.option("--save-baseline", is_flag=True, help="Store the results as the new baseline")
+@click.option("--threshold", type=float, default=0.2, show_default=True,
+              help="Maximum slowdown relative to the baseline, e.g. 0.2 for 20%")
+def suite(stages: Tuple[str, ...], num_events: int, num_insert: int, num_groups: int,
+          num_frames: int, fan_out: int, num_workers: int, grouping_config: str, seed: int,
+          repeat: int, baseline: Path, save_baseline: bool, threshold: float):
+    """ Run benchmark stages and compare them with the baseline """
+    params = {
+        'num_events': num_events, 'num_insert': num_insert, 'num_groups': num_groups,
+        'num_frames': num_frames, 'fan_out': fan_out, 'num_workers': num_workers,
+        'grouping_config': grouping_config, 'seed': seed,
+    }
+    has_sentry = importlib.util.find_spec("sentry") is not None
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        workload = Workload(Path(tmp_dir), params)
+        for stage in STAGES:
+            if stage not in stages:
+                continue
+            if stage in SENTRY_STAGES and not has_sentry:
+                print(f"{stage}: skipped, sentry is not installed")
+                continue
+            results[stage] = min(_STAGE_FUNCTIONS[stage](workload) for _ in range(repeat))
+
+    baseline_results = _load_baseline(baseline, params)
+    regressions = _print_results(results, baseline_results, threshold)
+
+    if save_baseline:
+        with open(baseline, 'w') as f:
+            json.dump({'params': params, 'results': results}, f, indent=4)
+        print(f"Saved baseline to {baseline}")
+    elif regressions:
+        print(f"Slower than baseline: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+def _load_baseline(path: Path, params: dict) -> Dict[str, float]:
+    try:
+        with open(path) as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        return {}
+
+    if baseline['params'] != params:
+        print(f"Not comparing with {path}, it was measured with {baseline['params']}")
+        return {}
+
+    return baseline['results']
+
+
+def _print_results(results: Dict[str, float], baseline: Dict[str, float],
+                   threshold: float) -> List[str]:
+    """ Return the stages which are slower than the baseline allows """
+    regressions = []
+    print(f"{'stage':>20} {'time [s]':>9} {'baseline [s]':>13} {'change':>8}")
+    for stage, seconds in results.items():
+        reference: Optional[float] = baseline.get(stage)
+        if reference is None:
+            print(f"{stage:>20} {seconds:>9.3f} {'-':>13} {'-':>8}")
+            continue
+
+        change = seconds / reference - 1
+        flag = ""
+        if change > threshold:
+            regressions.append(stage)
+            flag = " !"
+        print(f"{stage:>20} {seconds:>9.3f} {reference:>13.3f} {change:>+8.1%}{flag}")
+
+    return regressions
+
+
+def _time_generate(workload: Workload) -> float:
+    output_dir = workload.new_dir("generated")
+    t0 = time.perf_counter()
+    write_events(output_dir, 1, workload.params['num_events'], None, workload.generator)
+    elapsed = time.perf_counter() - t0
+    shutil.rmtree(output_dir)
+
+    return elapsed
+
+
+def _time_insert(workload: Workload, hierarchical: bool) -> float:
+    """ Like create_grouping_report.insert_result """
+    hashes = workload.hashes()
+    project = GroupNode("project_1", None)
+    records = RecordStore()
+    insert = project.insert_hierarchical if hierarchical else project.insert_flat
+
+    t0 = time.perf_counter()
+    for index, (flat, tree) in enumerate(hashes):
+        insert(tree if hierarchical else flat, records.add({'event_id': f"{index:032x}"}))
+
+    return time.perf_counter() - t0
+
+
+def _time_render(workload: Workload) -> float:
+    _configure_sentry()
+    # pylint: disable=import-outside-toplevel
+    from grouping_tests.blobs import BlobStore
+    from grouping_tests.report import ProjectReport
+
+    project = GroupNode("project_1", None)
+    for group, event in workload.generator.events("1", workload.params['num_events']):
+        flat, _ = workload.generator.group_hashes(group)
+        project.insert_flat(flat, _report_item(event))
+    project.exemplar = None
+
+    report_dir = workload.new_dir("render")
+    os.makedirs(report_dir)
+    t0 = time.perf_counter()
+    with BlobStore(report_dir) as blobs:
+        ProjectReport(project, report_dir, None, blobs)
+
+    return time.perf_counter() - t0
+
+
+def _time_report(workload: Workload) -> float:
+    """ Time reported by create_grouping_report.py itself, without interpreter startup """
+    event_dir = workload.event_dir()
+    config_path = workload.tmp_dir / "config.json"
+    with open(config_path, 'w') as f:
+        json.dump({'id': workload.params['grouping_config']}, f)
+
+    report_dir = workload.new_dir("report")
+    subprocess.run([
+        sys.executable, str(REPO_DIR / "create_grouping_report.py"),
+        "--event-dir", str(event_dir),
+        "--config", str(config_path),
+        "--report-dir", str(report_dir),
+        "--num-workers", str(workload.params['num_workers']),
+    ], check=True, cwd=REPO_DIR, stdout=subprocess.DEVNULL)
+
+    with open(report_dir / "meta.json") as f:
+        return json.load(f)['elapsed']
+
+
+def _report_item(event: dict) -> dict:
+    """ Like the items created by create_grouping_report.py, with made-up renders """
+    exception = event['exception']['values'][-1]
+    frames = exception['stacktrace']['frames']
+    stacktrace = "\n".join(f"  {frame['module']} in {frame['function']}" for frame in frames)
+    variants_dump = f"app:\n  hash: {exception['type']}\n{stacktrace}"
+
+    return {
+        'event_id': event['event_id'],
+        'title': exception['type'],
+        'subtitle': exception['value'],
+        'culprit': frames[-1]['function'],
+        'json_url': None,
+        'variants_digest': hashlib.sha1(variants_dump.encode()).hexdigest(),
+        'dump_variants': variants_dump,
+        'crash_report': None,
+        'stacktrace_render': f"{exception['type']}: {exception['value']}\n{stacktrace}",
+    }
+
+
+@lru_cache(maxsize=None)
+def _configure_sentry():
+    """ Same prelude as create_grouping_report.py """
+    os.environ['SENTRY_SKIP_SERVICE_VALIDATION'] = "yes"
+    from sentry.runner import configure  # pylint: disable=import-outside-toplevel
+    configure()
+
+
+_STAGE_FUNCTIONS: Dict[str, Callable[[Workload], float]] = {
+    "generate": _time_generate,
+    "insert flat": lambda workload: _time_insert(workload, hierarchical=False),
+    "insert hierarchical": lambda workload: _time_insert(workload, hierarchical=True),
+    "render": _time_render,
+    "report": _time_report,
+}
+
+
+if __name__ == "__main__":
+    suite()  # pylint: disable=no-value-for-parameter
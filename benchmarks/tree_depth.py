@@ -0,0 +1,63 @@
+""" Insertion into and traversal of deep hierarchical issue trees
+
+Usage:
+
+    python -m benchmarks.tree_depth --max-depth 50
+
+The time per event and tree level should stay roughly constant as the depth
+grows, i.e. both insertion and traversal are linear in the depth.
+"""
+import random
+import time
+
+import click
+
+from grouping_tests.groups.base import GroupNode, HashData
+
+
+@click.command()
+@click.option("--num-events", type=int, default=10000, show_default=True)
+@click.option("--max-depth", type=int, default=50, show_default=True)
+@click.option("--step", type=int, default=10, show_default=True)
+@click.option("--fan-out", type=int, default=2, show_default=True,
+              help="Number of distinct hashes per level")
+@click.option("--seed", type=int, default=0, show_default=True)
+def tree_depth(num_events: int, max_depth: int, step: int, fan_out: int, seed: int):
+    """ Time tree insertion and traversal for increasing depths """
+    print(f"{'depth':>6} {'nodes':>9} {'insert [s]':>11} {'traverse [s]':>13} "
+          f"{'us / event / level':>19}")
+    for depth in range(step, max_depth + 1, step):
+        paths = random_paths(num_events, depth, fan_out, seed)
+
+        project = GroupNode("project_1", None)
+        t0 = time.perf_counter()
+        for event_id, hashes in enumerate(paths):
+            project.insert_hierarchical(hashes, {'event_id': event_id})
+        insert_time = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        num_nodes = 0
+        for _, ancestors in project.nodes():
+            num_nodes += 1
+            len(ancestors)  # Touch ancestors like ProjectReport does
+        traverse_time = time.perf_counter() - t0
+
+        per_level = 1e6 * (insert_time + traverse_time) / (num_events * depth)
+        print(f"{depth:>6} {num_nodes:>9} {insert_time:>11.3f} {traverse_time:>13.3f} "
+              f"{per_level:>19.3f}")
+
+
+def random_paths(num_events: int, depth: int, fan_out: int, seed: int):
+    rng = random.Random(seed)
+
+    return [
+        [
+            HashData(f"{level:02d}{rng.randrange(fan_out):030x}", f"level {level}")
+            for level in range(depth)
+        ]
+        for _ in range(num_events)
+    ]
+
+
+if __name__ == "__main__":
+    tree_depth()  # pylint: disable=no-value-for-parameter
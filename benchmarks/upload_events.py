@@ -0,0 +1,48 @@
+""" Throughput and rate limit handling of the upload engine, against a local Relay
+
+Usage:
+
+    python -m benchmarks.upload_events --num-events 2000 --relay-limit 500
+
+Runs without sentry. Without a target rate, the uploader runs into the rate
+limit and has to back off. With ``--events-per-second`` at or below the limit,
+it should not be rate limited at all. Either way, nothing should be dropped.
+"""
+import time
+from typing import Optional
+
+import click
+
+from benchmarks.standins import LocalRelay
+from grouping_tests.upload import Uploader
+
+
+@click.command()
+@click.option("--num-events", type=int, default=2000, show_default=True)
+@click.option("--network-threads", type=int, default=64, show_default=True)
+@click.option("--relay-limit", type=float, default=500, show_default=True,
+              help="Events per second accepted by the local relay")
+@click.option("--events-per-second", type=float,
+              help="Target rate of the uploader. Defaults to 90%% of --relay-limit")
+def upload_events(num_events: int, network_threads: int, relay_limit: float,
+                  events_per_second: Optional[float]):
+    """ Upload synthetic envelopes without and with a target rate """
+    body = b'{"event_id":"0"}\n{"type":"event"}\n{}\n'
+
+    print(f"{'target rate':>11} {'time [s]':>9} {'sent':>6} {'retries':>8} {'dropped':>8}")
+    for rate in [None, events_per_second or 0.9 * relay_limit]:
+        relay = LocalRelay(relay_limit)
+        uploader = Uploader(relay, network_threads, rate, backoff=0.1)
+        t0 = time.perf_counter()
+        for _ in range(num_events):
+            uploader.submit(body)
+        stats = uploader.close()
+        elapsed = time.perf_counter() - t0
+
+        rate_str = f"{rate:.0f}" if rate else "-"
+        print(f"{rate_str:>11} {elapsed:>9.2f} {stats.num_sent:>6} {stats.num_retried:>8} "
+              f"{stats.num_dropped:>8}")
+
+
+if __name__ == "__main__":
+    upload_events()  # pylint: disable=no-value-for-parameter
@@ -0,0 +1,74 @@
+""" Throughput and resumption of the wipe engine, against a local sqlite database
+
+Usage:
+
+    python -m benchmarks.wipe_project --num-groups 5000
+
+Runs without sentry. Compares deleting groups one by one, like wipe_project.py
+used to do it, with deleting chunks of groups on a pool of threads. Then stops
+a wipe halfway and runs it again, which should leave no groups behind.
+"""
+import itertools
+import os
+import tempfile
+import time
+from functools import partial
+
+import click
+
+from benchmarks.standins import LocalGroupDatabase
+from grouping_tests.wipe import delete_in_chunks, iter_id_chunks
+
+PROJECT_ID = 1
+
+
+@click.command()
+@click.option("--num-groups", type=int, default=5000, show_default=True)
+@click.option("--chunk-size", type=int, default=100, show_default=True)
+@click.option("--num-workers", type=int, default=8, show_default=True)
+@click.option("--latency", type=float, default=2.0, show_default=True,
+              help="Simulated time to delete one group [ms]")
+def wipe_project(num_groups: int, chunk_size: int, num_workers: int, latency: float):
+    """ Wipe a local database sequentially and in chunks """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        database = LocalGroupDatabase(os.path.join(tmp_dir, "groups.sqlite"), latency / 1000)
+
+        print(f"{'mode':>10} {'time [s]':>9} {'deleted':>8} {'groups/s':>9} {'left':>6}")
+        for name, wipe in [
+            ("sequential", partial(_wipe_sequentially, database)),
+            ("chunked", partial(_wipe, database, chunk_size, num_workers)),
+            ("resumed", partial(_wipe_twice, database, chunk_size, num_workers)),
+        ]:
+            database.populate(PROJECT_ID, num_groups)
+            t0 = time.perf_counter()
+            num_deleted = wipe()
+            elapsed = time.perf_counter() - t0
+            print(f"{name:>10} {elapsed:>9.2f} {num_deleted:>8} {num_deleted / elapsed:>9.1f} "
+                  f"{database.count(PROJECT_ID):>6}")
+
+
+def _wipe_sequentially(database: LocalGroupDatabase) -> int:
+    group_ids = database.fetch_ids(PROJECT_ID, 0, -1)
+
+    return sum(database.delete_ids([group_id]) for group_id in group_ids)
+
+
+def _wipe(database: LocalGroupDatabase, chunk_size: int, num_workers: int,
+          max_chunks: int = None) -> int:
+    chunks = iter_id_chunks(partial(database.fetch_ids, PROJECT_ID), chunk_size)
+    if max_chunks is not None:
+        chunks = itertools.islice(chunks, max_chunks)
+
+    return delete_in_chunks(chunks, database.delete_ids, num_workers).num_deleted
+
+
+def _wipe_twice(database: LocalGroupDatabase, chunk_size: int, num_workers: int) -> int:
+    """ Interrupt the first run halfway, then start over """
+    half = database.count(PROJECT_ID) // chunk_size // 2
+
+    return (_wipe(database, chunk_size, num_workers, max_chunks=half)
+            + _wipe(database, chunk_size, num_workers))
+
+
+if __name__ == "__main__":
+    wipe_project()  # pylint: disable=no-value-for-parameter
@@ -15,9 +15,13 @@ import json
 import glob
 import pickle
 import time
+import queue
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
 from pathlib import Path
-from typing import List, Optional
-from multiprocessing import Manager
+from itertools import islice
+from typing import Callable, Dict, IO, Iterable, Iterator, List, Optional, Set
+from multiprocessing import Pool, cpu_count
 
 from django.utils.timezone import now
 from sentry.eventstore.models import Event
@@ -31,17 +35,27 @@ from sentry.event_manager import materialize_metadata, get_culprit
 import sentry_sdk
 sentry_sdk.init("")
 
+from grouping_tests.blobs import BlobStore
+from grouping_tests.cache import ResultCache, config_digest
+from grouping_tests.corpus import CorpusReader, is_corpus
+from grouping_tests.fetch import event_id_from_path, event_path
 from grouping_tests.groups.base import GroupNode, HashData
-from grouping_tests.report import HTMLReport, ProjectReport
-from grouping_tests.crash import (
-    get_crash_report, dump_variants, get_stacktrace_render)
+from grouping_tests.groups.records import Record, RecordStore
+from grouping_tests.report import ComparisonReport, HTMLReport, ProjectReport
+from grouping_tests.stats import STATS
+from grouping_tests.stream import read_documents, split_header
+from grouping_tests.crash import get_crash_report, get_stacktrace_render
+from grouping_tests.grouping import evaluate_grouping
 
 
 LOG = logging.getLogger(__name__)
 
 
 @click.command()
-@click.option("--event-dir", required=True, type=Path, help="created using store_events.py")
+@click.option("--event-dir", type=Path, help="created using store_events.py")
+@click.option("--event-stream", type=click.File('r'),
+              help="Alternative to --event-dir: multi doc stream created using dump_events.py. "
+                   "Can be a file, a named pipe or - for stdin.")
 @click.option("--config", "-c", required=True, type=Path, multiple=True,
               help="Grouping config. Multiple will be merged left to right.")
 @click.option("--enhancements", type=Path, multiple=True,
@@ -51,29 +65,141 @@ LOG = logging.getLogger(__name__)
               help="Base URL for JSON links. Defaults to --event-dir")
 @click.option("--num-workers", type=int,
               help="Parallelize. Default corresponds to Python multiprocessing default")
+@click.option("--chunksize", type=int, default=50, show_default=True,
+              help="Number of events sent to a worker process at once")
 @click.option(
     "--pickle-dir",
     type=Path,
     help="If set, cache issue trees as pickles. Useful for development.")
-def create_grouping_report(event_dir: Path, config: List[Path], enhancements: List[Path],
+@click.option(
+    "--cache-dir",
+    type=Path,
+    help="If set, cache grouping results per event and config. "
+         "Only events whose payload or config changed are regrouped.")
+@click.option("--cache-size", type=int, default=2048, show_default=True,
+              help="Maximum size of --cache-dir in MB. Enforced while writing, "
+                   "each worker can exceed it by a tenth before evicting")
+@click.option(
+    "--two-phase/--single-phase", default=False,
+    help="Group all events first, then render crash reports and variant dumps "
+         "only for events that are shown in the report. Requires --event-dir.")
+@click.option(
+    "--baseline-config", type=Path, multiple=True,
+    help="Also group every event by this config (merged like --config), and list which of "
+         "its groups were split or merged by --config.")
+@click.option(
+    "--max-events-per-node", type=click.IntRange(min=1),
+    help="Only list a sample of this many events per node. Event counts stay exact.")
+@click.option(
+    "--previous-report", type=Path,
+    help="Report created from the same events with a different config. Pages that "
+         "did not change are linked from there instead of being rendered again.")
+def create_grouping_report(event_dir: Path, event_stream: IO[str],
+                           config: List[Path], enhancements: List[Path],
                            report_dir: Path,
-                           events_base_url: str, pickle_dir: Path, num_workers: int):
+                           events_base_url: str, pickle_dir: Path, num_workers: int,
+                           chunksize: int,
+                           cache_dir: Path, cache_size: int, two_phase: bool,
+                           baseline_config: List[Path], max_events_per_node: Optional[int],
+                           previous_report: Optional[Path]):
     """ Create a grouping report """
 
-    if events_base_url is None:
+    if (event_dir is None) == (event_stream is None):
+        LOG.error("Specify exactly one of --event-dir and --event-stream")
+        sys.exit(1)
+
+    if event_stream is not None and pickle_dir:
+        LOG.error("--pickle-dir cannot be used with --event-stream")
+        sys.exit(1)
+
+    if event_stream is not None and two_phase:
+        LOG.error("--two-phase cannot be used with --event-stream")
+        sys.exit(1)
+
+    if baseline_config and pickle_dir:
+        LOG.error("--pickle-dir cannot be used with --baseline-config")
+        sys.exit(1)
+
+    if baseline_config and max_events_per_node:
+        # The comparison needs to know where every single event ended up
+        LOG.error("--max-events-per-node cannot be used with --baseline-config")
+        sys.exit(1)
+
+    if events_base_url is None and event_dir is not None:
         events_base_url = f"file://{event_dir.absolute()}"
 
     if report_dir.exists():
         LOG.error("Report dir %s already exists", report_dir)
         sys.exit(1)
 
+    if previous_report is not None and not (previous_report / "meta.json").exists():
+        LOG.error("%s is not a report", previous_report)
+        sys.exit(1)
+
     os.makedirs(report_dir, exist_ok=True)
 
+    GroupNode.max_items = max_events_per_node
+    # Items are kept in a RecordStore, see insert_result. Free the rows of
+    # those left out of a sample, so memory stays bounded as well. With a
+    # baseline, both trees share the items, and an item dropped from one
+    # can still be in the other's sample
+    GroupNode.on_drop = None if baseline_config else Record.remove
+
     if pickle_dir:
         os.makedirs(pickle_dir, exist_ok=True)
 
+    config_dict = load_config(config, enhancements)
+    baseline_config_dict = load_config(baseline_config, []) if baseline_config else None
+
+    report_metadata = write_metadata(report_dir, config_dict, baseline_config_dict)
+
+    cache = None
+    if cache_dir:
+        extra = [config_digest(baseline_config_dict)] if baseline_config_dict else []
+        cache = ResultCache(
+            cache_dir, config_digest(config_dict, get_version(), *extra), cache_size * 1024 * 1024)
+
+    t0 = time.time()
+
+    on_grouped = partial(store_pickle, pickle_dir) if pickle_dir else None
+
+    num_workers = num_workers or cpu_count()
+    with BlobStore(report_dir) as blobs, \
+            create_pool(num_workers, event_dir, config_dict, cache, two_phase,
+                        baseline_config_dict) as pool, \
+            create_render_pool(num_workers) as render_pool:
+        # Reports are rendered by a pool of their own, so their shards do not
+        # queue up behind the grouping batches of other projects
+        write_report = partial(
+            write_project_report, report_dir=report_dir, events_base_url=events_base_url,
+            blobs=blobs, pool=render_pool, num_workers=num_workers,
+            previous_dir=previous_report)
+        scheduler = ReportScheduler(
+            pool, num_workers, chunksize, two_phase, write_report, on_grouped,
+            compare=baseline_config_dict is not None)
+        if event_stream is not None:
+            scheduler.group_stream(event_stream)
+        else:
+            scheduler.group_event_dir(event_dir, pickle_dir)
+        scheduler.close()
+
+    stats = STATS.to_dict()
+    HTMLReport(report_dir, report_metadata, scheduler.project_ids,
+               comparison=baseline_config_dict is not None, stats=stats)
+
+    if cache is not None:
+        cache.evict()
+
+    elapsed = time.time() - t0
+    save_metadata(report_dir, {**report_metadata, 'elapsed': elapsed, 'stats': stats})
+
+    LOG.info("Done. Time ellapsed: %s", elapsed)
+
+
+def load_config(config_paths: List[Path], enhancements: List[Path]) -> dict:
+    """ Merge configs left to right and serialize their enhancements """
     config_dict = {}
-    for config_path in config:
+    for config_path in config_paths:
         with open(config_path, 'r') as config_file:
             config_dict.update(**json.load(config_file))
 
@@ -91,127 +217,545 @@ def create_grouping_report(event_dir: Path, config: List[Path], enhancements: Li
         bases=config_dict.pop("enhancement_bases", None) or [DEFAULT_GROUPING_ENHANCEMENTS_BASE]
     ).dumps()
 
-    report_metadata = write_metadata(report_dir, config_dict)
+    return config_dict
+
+
+#: Kinds of tasks sent to the worker pool
+GROUP = "group"
+GROUP_DOCUMENTS = "group_documents"
+RENDER = "render"
+
+
+class ReportScheduler:
+
+    """ Group events of all projects in one long-lived worker pool
+
+    Results are routed to per-project trees. As soon as all events of a project
+    are grouped, its report is written in a background thread while the pool
+    continues with the events of the remaining projects.
+
+    With ``compare``, every project also gets a tree for the baseline config,
+    built from the same items, which is passed to ``write_report`` as well.
+    """
+
+    def __init__(self, pool, num_workers: Optional[int], chunksize: int, two_phase: bool,
+                 write_report: Callable[[GroupNode, Optional[GroupNode]], None],
+                 on_grouped: Optional[Callable[[GroupNode], None]] = None,
+                 compare: bool = False):
+        self._pool = pool
+        # Do not read more input than the workers can keep up with
+        self._max_in_flight = 4 * (num_workers or cpu_count())
+        self._chunksize = chunksize
+        self._two_phase = two_phase
+        self._write_report = write_report
+        self._on_grouped = on_grouped
+        self._compare = compare
+
+        self.project_ids: List[str] = []
+        self._projects: Dict[str, GroupNode] = {}  # Projects still being grouped
+        self._baselines: Dict[str, GroupNode] = {}  # Same, grouped by the baseline config
+        self._records: Dict[str, RecordStore] = {}  # Items of projects being grouped
+        self._pending: Dict[str, int] = {}  # Batches in flight per project
+        self._sealed: Set[str] = set()  # Projects which will get no more batches
+        self._render_items: Dict[str, Dict[str, List[dict]]] = {}  # See _submit_render
+        self._results: queue.Queue = queue.Queue()
+        self._in_flight = 0
+
+        self._progress_bar = None
+        self._report_writer = ThreadPoolExecutor(max_workers=1)
+        self._reports: List[Future] = []
+
+    def group_event_dir(self, event_dir: Path, pickle_dir: Optional[Path]):
+        filenames_by_project = {}
+        for entry in os.scandir(event_dir):
+            project = None
+            if pickle_dir:
+                LOG.info("Project %s: Load from pickle...", entry.name)
+                project = load_pickle(pickle_dir, entry.name)
+
+            if project is None:
+                LOG.info("Project %s: Collecting filenames...", entry.name)
+                filenames_by_project[entry.name] = list_event_files(Path(entry.path))
+            else:
+                self.project_ids.append(project.name)
+                self._finish(project)
+
+        num_events = sum(len(filenames) for filenames in filenames_by_project.values())
+        LOG.info("Building issue trees for %s projects...", len(filenames_by_project))
+        with click.progressbar(length=num_events) as self._progress_bar:
+            for project_id, filenames in filenames_by_project.items():
+                self._add_project(project_id)
+                for batch in batches(filenames, self._chunksize):
+                    self._submit(GROUP, project_id, batch)
+                self._seal(project_id)
+
+            self._drain()
+
+    def group_stream(self, event_stream: IO[str]):
+        """ Build issue trees for all projects in the stream while it is being read """
+        header, documents = split_header(read_documents(event_stream))
+        # Only an estimate, but good enough for the progress bar
+        num_events = header.get("max_events") or 1000  # just a guess
+
+        LOG.info("Building issue trees from event stream...")
+        with click.progressbar(length=num_events) as self._progress_bar:
+            for batch in batches(documents, self._chunksize):
+                self._submit(GROUP_DOCUMENTS, None, batch)
+
+            # Only now do we know that all projects are complete
+            self._drain()
+            for project_id in sorted(self._projects):
+                self._seal(project_id)
+
+            self._drain()
+
+    def close(self):
+        """ Wait for all reports to be written """
+        self._drain()
+        for report in self._reports:
+            report.result()  # Raise exceptions from writer thread
+        self._report_writer.shutdown()
+
+    def _add_project(self, project_id: str) -> GroupNode:
+        # Create a root node for all groups
+        project = self._projects[project_id] = GroupNode(project_id, None)
+        if self._compare:
+            self._baselines[project_id] = GroupNode(project_id, None)
+        self._records[project_id] = RecordStore()
+        self._pending[project_id] = 0
+        self.project_ids.append(project_id)
+
+        return project
+
+    def _submit(self, kind: str, project_id: Optional[str], batch: list):
+        while self._in_flight >= self._max_in_flight:
+            self._handle(*self._results.get())
+
+        task = (kind, project_id, batch)
+        if project_id is not None:
+            self._pending[project_id] += 1
+        self._in_flight += 1
+        self._pool.apply_async(
+            run_task, (task, ),
+            callback=self._results.put,
+            error_callback=partial(self._on_error, task)
+        )
 
-    t0 = time.time()
+    def _on_error(self, task, exception):
+        """ Called from the pool's result thread """
+        kind, project_id, batch = task
+        LOG.error("Failed to run %s task with %s items: %s", kind, len(batch), exception)
+        self._results.put((kind, project_id, len(batch), None, None))
+
+    def _drain(self):
+        while self._in_flight:
+            self._handle(*self._results.get())
+
+    def _handle(self, kind: str, project_id: Optional[str], batch_size: int,
+                data: Optional[bytes], stats: Optional[dict]):
+        """ Handle the result of run_task """
+        self._in_flight -= 1
+
+        if stats is not None:
+            STATS.merge(stats)
+        with STATS.timer("deserialize results"):
+            results = [] if data is None else pickle.loads(data)
+
+        if kind == GROUP:
+            project = self._projects[project_id]
+            records = self._records[project_id]
+            baseline = self._baselines.get(project_id)
+            with STATS.timer("tree insertion"):
+                for result in results:
+                    insert_result(project, result, records, baseline)
+        elif kind == GROUP_DOCUMENTS:
+            with STATS.timer("tree insertion"):
+                for result_project_id, result in results:
+                    project = self._projects.get(result_project_id)
+                    if project is None:
+                        project = self._add_project(result_project_id)
+                    insert_result(project, result, self._records[result_project_id],
+                                  self._baselines.get(result_project_id))
+        elif kind == RENDER:
+            items_by_url = self._render_items[project_id]
+            for json_url, artifacts in results:
+                for item in items_by_url[json_url]:
+                    item.update(artifacts)
+
+        if kind != RENDER:
+            self._progress_bar.update(batch_size)
+
+        if project_id is not None:
+            self._pending[project_id] -= 1
+            self._maybe_finish(project_id)
+
+    def _seal(self, project_id: str):
+        self._sealed.add(project_id)
+        self._maybe_finish(project_id)
+
+    def _maybe_finish(self, project_id: str):
+        if project_id not in self._sealed or self._pending[project_id]:
+            return
+
+        self._sealed.remove(project_id)
+        project = self._projects[project_id]
+        if self._two_phase and project_id not in self._render_items:
+            LOG.info("Project %s: Rendering event artifacts...", project_id)
+            self._submit_render(project)
+            self._seal(project_id)
+        else:
+            del self._projects[project_id]
+            del self._records[project_id]
+            del self._pending[project_id]
+            self._render_items.pop(project_id, None)
+            if self._on_grouped is not None:
+                self._on_grouped(project)
+            self._finish(project, self._baselines.pop(project_id, None))
+
+    def _submit_render(self, project: GroupNode):
+        """ Second phase: render crash reports etc. only for events the report displays
+
+        These are the exemplars of each node, and events whose variants differ from
+        their node's exemplar (see ProjectReport._store_blobs).
+        """
+        items_by_url = self._render_items[project.name] = {}
+        for node, _ in project.nodes():
+            exemplar = node.exemplar
+            if exemplar is None:
+                continue
+            for item in [exemplar, *node.items]:
+                if item is exemplar or item['variants_digest'] != exemplar['variants_digest']:
+                    items_by_url.setdefault(item['json_url'], []).append(item)
+
+        for batch in batches(items_by_url, self._chunksize):
+            self._submit(RENDER, project.name, batch)
+
+    def _finish(self, project: GroupNode, baseline: Optional[GroupNode] = None):
+        """ Write the report of a completely grouped project in the background """
+        self._reports.append(self._report_writer.submit(self._write_report, project, baseline))
+
+
+def insert_result(project: GroupNode, result, records: RecordStore,
+                  baseline: Optional[GroupNode] = None):
+    flat, hierarchical, item = result
+    baseline_hashes = item.pop('baseline_hashes', None)
+    item = records.add(item)
+    insert_hashes(project, flat, hierarchical, item)
+    if baseline is not None:
+        # Both trees share the item, see diff_groups
+        insert_hashes(baseline, *baseline_hashes, item)
+
+
+def insert_hashes(project: GroupNode, flat: List[HashData], hierarchical: List[HashData], item):
+    if hierarchical:
+        project.insert_hierarchical(hierarchical, item)
+    else:
+        flat = flat or [HashData("NO_HASH", None)]
+        project.insert_flat(flat, item)
+
+
+def write_project_report(project: GroupNode, baseline: Optional[GroupNode], report_dir: Path,
+                         events_base_url: Optional[str], blobs: BlobStore, pool=None,
+                         num_workers: int = 1, previous_dir: Optional[Path] = None):
+    # HACKish makes sure that project does not display hash, stack trace, etc.
+    project.exemplar = None
+
+    ProjectReport(project, report_dir, events_base_url, blobs, pool, num_workers, previous_dir)
+
+    if baseline is not None:
+        LOG.info("Project %s: Comparing with baseline...", project.name)
+        ComparisonReport(baseline, project, report_dir)
+
+    LOG.info("Project %s: Done.", project.name)
+
+
+def list_event_files(project_dir: Path) -> List[str]:
+    """ Paths of all events of a project
+
+    Events in a corpus (see grouping_tests.corpus) are not stored as files, but
+    their paths still serve as URLs. See extract_events.py.
+    """
+    if is_corpus(project_dir):
+        reader = CorpusReader(project_dir)
+        return [str(project_dir / event_path(event_id)) for event_id in reader.event_ids()]
 
-    project_ids = []
-    for entry in os.scandir(event_dir):
-        project_id = entry.name
-        project_ids.append(project_id)
+    # iglob would be easier on memory, but we want to use the progress bar
+    return glob.glob(f"{project_dir}/**/*json", recursive=True)
 
-        project = None
-        if pickle_dir:
-            LOG.info("Project %s: Load from pickle...", project_id)
-            project = load_pickle(pickle_dir, project_id)
 
-        if project is None:
-            project = generate_project_tree(
-                event_dir, config_dict, entry, num_workers)
-            if pickle_dir:
-                store_pickle(pickle_dir, project)
+def batches(iterable: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
 
-        # HACKish makes sure that project does not display hash, stack trace, etc.
-        project.exemplar = None
+def create_pool(num_workers, *initargs):
+    """ Process pool whose workers each hold their own EventProcessor """
+    if num_workers == 1:
+        # Keep everything in this process, useful for debugging
+        init_worker(*initargs)
+        return InProcessPool()
 
-        ProjectReport(project, report_dir, events_base_url)
+    return Pool(num_workers, initializer=init_worker, initargs=initargs)
 
-        LOG.info("Project %s: Done.", project_id)
 
-    HTMLReport(report_dir, report_metadata, project_ids)
+def create_render_pool(num_workers):
+    """ Process pool for rendering reports, see ProjectReport """
+    if num_workers == 1:
+        return InProcessPool()
 
-    LOG.info("Done. Time ellapsed: %s", (time.time() - t0))
+    return Pool(num_workers)
 
 
-def generate_project_tree(event_dir, config, entry, num_workers):
+class InProcessPool:
 
-    project_id = entry.name
+    """ Stand-in for multiprocessing.Pool which runs tasks right away """
 
-    # Create a root node for all groups
-    project = GroupNode(project_id, None)
+    def __enter__(self):
+        return self
 
-    LOG.info("Project %s: Collecting filenames...", project_id)
-    # iglob would be easier on memory, but we want to use the progress bar
-    filenames = glob.glob(f"{entry.path}/**/*json", recursive=True)
-
-    LOG.info("Project %s: Building issue tree...", project_id)
-    with Manager() as manager:
-        with manager.Pool(num_workers) as pool:
-            processor = EventProcessor(event_dir, config, project_id)
-            results = map_fn(pool, num_workers)(processor, filenames)
-            progress_bar = click.progressbar(results, length=len(filenames))
-            with progress_bar:
-                for result in progress_bar:
-                    if result is not None:
-                        flat, hierarchical, item = result
-                        if hierarchical:
-                            project.insert_hierarchical(hierarchical, item)
-                        else:
-                            flat = flat or [HashData("NO_HASH", None)]
-                            project.insert_flat(flat, item)
-
-    return project
-
-
-def map_fn(pool, num_workers):
-    if num_workers == 1:
-        # Keep everything in this thread, useful for debugging
-        return map
+    def __exit__(self, *args):
+        pass
+
+    @staticmethod
+    def apply_async(func, args=(), callback=None, error_callback=None):
+        try:
+            result = func(*args)
+        except Exception as e:  # pylint: disable=broad-except
+            error_callback(e)
+        else:
+            callback(result)
+
+    @staticmethod
+    def imap_unordered(func, iterable):
+        return map(func, iterable)
+
+
+_processor: Optional['EventProcessor'] = None  # One per worker process, see init_worker
+
+
+def init_worker(*args):
+    """ Load the grouping config once per worker instead of once per task """
+    global _processor  # pylint: disable=global-statement
+    _processor = EventProcessor(*args)
+
+
+def run_task(task):
+    """ Process a batch in a worker
+
+    Returns the batch size along with the pickled results, so that the cost
+    of sending them shows up in the stats, and the stats of the worker.
+    """
+    kind, project_id, batch = task
+    if kind == GROUP:
+        results = (_processor(project_id, filename) for filename in batch)
+    elif kind == GROUP_DOCUMENTS:
+        results = (_processor.process_document(document) for document in batch)
+    elif kind == RENDER:
+        results = (_processor.render(project_id, json_url) for json_url in batch)
+    else:
+        raise ValueError(f"Unknown task kind {kind}")
+
+    results = [result for result in results if result is not None]
+    with STATS.timer("serialize results"):
+        data = pickle.dumps(results, protocol=pickle.HIGHEST_PROTOCOL)
+    STATS.count("result bytes", len(data))
 
-    return pool.imap_unordered
+    return kind, project_id, len(batch), data, STATS.pop()
 
 
 class EventProcessor:
 
-    def __init__(self, event_dir, config, project_id):
+    def __init__(self, event_dir, config, cache: Optional[ResultCache] = None,
+                 light: bool = False, baseline_config: Optional[dict] = None):
         self._event_dir = event_dir
         self._config = config
-        self._structured_config = None  # pickling workaround
-        self._project_id = project_id
-        self._seen = set()
+        self._structured_config = load_grouping_config(config)
+        self._baseline_config = baseline_config
+        self._structured_baseline_config = (
+            load_grouping_config(baseline_config) if baseline_config else None
+        )
+        self._cache = cache
+        self._light = light  # If True, leave rendering to render()
+        self._corpora: Dict[str, Optional[CorpusReader]] = {}  # By project, see _read_payload
 
-    def __call__(self, filename):
+    def __call__(self, project_id, filename):
         try:
-            return self._process(filename)
+            return self._process(project_id, filename)
         except Exception as e:
+            STATS.count("errors")
             LOG.warning("Exception occured while processing event %s", filename)
             LOG.exception(e)
 
-    def _process(self, filename):
-        with open(filename, 'r') as file_:
-            event_data = json.load(file_)
+    def process_document(self, document: str):
+        """ Like __call__, but for a raw JSON document read from an event stream
 
-        if self._structured_config is None:
-            self._structured_config = load_grouping_config(self._config)
+        Returns the project the event belongs to along with the result, or
+        None if the event is skipped.
+        """
+        try:
+            return self._process_document(document)
+        except Exception as e:
+            STATS.count("errors")
+            LOG.warning("Exception occured while processing event %s", document[:100])
+            LOG.exception(e)
 
-        normalize_stacktraces_for_grouping(event_data, grouping_config=self._structured_config)
-        event_data.pop("metadata", None)
-        event_data.pop("culprit", None)
-        event_data['culprit'] = get_culprit(event_data)
-        event_data.update(materialize_metadata(event_data))
-        event_id = event_data['event_id']
-        event = Event(
-            self._project_id, event_id, group_id=None, data=event_data)
+    def render(self, project_id, json_url: str):
+        """ Render crash report, stacktrace and variants for an already grouped event """
+        try:
+            payload = self._read_payload(project_id, self._event_dir / json_url)
+            event = self._load_event(self._load_json(payload), project_id)
+            with STATS.timer("get_grouping_variants"):
+                grouping = evaluate_grouping(event, self._config)
+            with STATS.timer("dump_variants"):
+                variants_dump = grouping.dump()
+
+            return json_url, self._render(event, variants_dump)
+        except Exception as e:
+            STATS.count("errors")
+            LOG.warning("Exception occured while rendering event %s", json_url)
+            LOG.exception(e)
 
-        flat_variants, hierarchical_variants = (
-            event.get_sorted_grouping_variants(force_config=self._config)
-        )
+    def _process(self, project_id, filename):
+        payload = self._read_payload(project_id, filename)
+
+        result = self._cached_group(payload, project_id)
+
+        # Not part of the cache key, so set it on every hit
+        _, _, item = result
+        item['json_url'] = str(Path(filename).relative_to(self._event_dir))
+
+        return result
+
+    def _read_payload(self, project_id, filename) -> bytes:
+        """ Read from the project's corpus if it has one, from the file otherwise """
+        if project_id not in self._corpora:
+            project_dir = self._event_dir / project_id
+            self._corpora[project_id] = CorpusReader(project_dir) if is_corpus(project_dir) else None
+
+        corpus = self._corpora[project_id]
+        with STATS.timer("read event"):
+            if corpus is None:
+                with open(filename, 'rb') as file_:
+                    payload = file_.read()
+            else:
+                payload = corpus.read(event_id_from_path(filename))
+                if payload is None:
+                    raise FileNotFoundError(filename)
+
+        STATS.count("event bytes", len(payload))
+
+        return payload
+
+    def _process_document(self, document: str):
+        payload = document.encode()
+        STATS.count("event bytes", len(payload))
+        event_data = self._load_json(payload)
+        if event_data.get('project') is None:
+            STATS.count("events without project")
+            LOG.warning("Skipping event %s without project", event_data.get('event_id'))
+            return None
+        project_id = f"project_{event_data['project']}"
+
+        result = self._cached_group(payload, project_id, event_data)
+
+        # Events from a stream have no file to link to
+        _, _, item = result
+        item['json_url'] = None
 
-        flat = self._get_hashes(flat_variants)
-        hierarchical = self._get_hashes(hierarchical_variants)
+        return project_id, result
 
+    def _cached_group(self, payload: bytes, project_id: str, event_data: Optional[dict] = None):
+        if self._cache is None:
+            return self._group(payload, project_id, event_data)
+
+        cache_key = self._cache.key(payload, "light" if self._light else "full")
+        result = self._cache.get(cache_key)
+        if result is None:
+            STATS.count("cache misses")
+            result = self._group(payload, project_id, event_data)
+            self._cache.put(cache_key, result)
+        else:
+            STATS.count("cache hits")
+
+        return result
+
+    def _group(self, payload: bytes, project_id: str, event_data: Optional[dict] = None):
+        if event_data is None:
+            event_data = self._load_json(payload)
+
+        STATS.count("events")
+        STATS.count("exceptions", len((event_data.get('exception') or {}).get('values') or ()))
+
+        event = self._load_event(event_data, project_id)
+
+        # Hashes and the dump come from the same variants, see GroupingResult
+        with STATS.timer("get_grouping_variants"):
+            grouping = evaluate_grouping(event, self._config)
+
+        flat = self._get_hashes(grouping.flat)
+        hierarchical = self._get_hashes(grouping.hierarchical)
 
         item = extract_event_data(event)
-        item['json_url'] = Path(filename).relative_to(self._event_dir)
 
-        # Seems abundant to do this for every event, but it's faster
-        # than synchronising between processes when to generate
-        item['crash_report'] = get_crash_report(event)
-        item['stacktrace_render'] = get_stacktrace_render(event)
-        item['dump_variants'] = dump_variants(self._config, event)
+        # With --two-phase, dumps are only rendered for events whose digest differs
+        # from their node's exemplar, see ReportScheduler._submit_render
+        with STATS.timer("variants digest"):
+            item['variants_digest'] = grouping.digest()
+
+        if self._baseline_config is not None:
+            # The event above has been normalized for the current config, so decode the
+            # payload again rather than reading it again. See insert_result.
+            baseline_event = self._load_event(
+                self._load_json(payload), project_id, self._structured_baseline_config)
+            with STATS.timer("get_grouping_variants (baseline)"):
+                baseline = evaluate_grouping(baseline_event, self._baseline_config)
+            item['baseline_hashes'] = (
+                self._get_hashes(baseline.flat), self._get_hashes(baseline.hierarchical)
+            )
+
+        if not self._light:
+            # Seems abundant to do this for every event, but it's faster
+            # than synchronising between processes when to generate
+            with STATS.timer("dump_variants"):
+                variants_dump = grouping.dump()
+            item.update(self._render(event, variants_dump))
 
         return flat, hierarchical, item
 
+    @staticmethod
+    def _load_json(payload: bytes) -> dict:
+        with STATS.timer("load JSON"):
+            return json.loads(payload)
+
+    def _load_event(self, event_data: dict, project_id: str, structured_config=None) -> Event:
+        with STATS.timer("normalize_stacktraces_for_grouping"):
+            normalize_stacktraces_for_grouping(
+                event_data, grouping_config=structured_config or self._structured_config)
+        event_data.pop("metadata", None)
+        event_data.pop("culprit", None)
+        event_data['culprit'] = get_culprit(event_data)
+        event_data.update(materialize_metadata(event_data))
+        event_id = event_data['event_id']
+
+        return Event(project_id, event_id, group_id=None, data=event_data)
+
+    @staticmethod
+    def _render(event: Event, variants_dump: str) -> dict:
+        with STATS.timer("get_crash_report"):
+            crash_report = get_crash_report(event)
+        with STATS.timer("get_stacktrace_render"):
+            stacktrace_render = get_stacktrace_render(event)
+
+        return {
+            'crash_report': crash_report,
+            'stacktrace_render': stacktrace_render,
+            'dump_variants': variants_dump,
+        }
+
     @classmethod
     def _get_hashes(cls, variants: List[BaseVariant]) -> List[HashData]:
         """ Get hash and label for each variant and filter out None hashes """
@@ -241,21 +785,26 @@ def extract_event_data(event: Event) -> dict:
     }
 
 
-def write_metadata(report_dir: Path, config: dict):
+def write_metadata(report_dir: Path, config: dict, baseline_config: Optional[dict] = None):
     meta = {
         'generated': str(now()),
         'cli_args': sys.argv,
         'config': config,
+        'baseline_config': baseline_config,
         'sentry_version': get_version(),
         'grouping_tests_revision': _get_git_revision(Path(__file__).parent)
     }
 
-    with open(report_dir / "meta.json", 'w') as f:
-        json.dump(meta, f, indent=4)
+    save_metadata(report_dir, meta)
 
     return meta
 
 
+def save_metadata(report_dir: Path, meta: dict):
+    with open(report_dir / "meta.json", 'w') as f:
+        json.dump(meta, f, indent=4)
+
+
 def load_pickle(pickle_dir: Path, project_id: str) -> Optional[GroupNode]:
     filename = pickle_dir / f"{project_id}.pickle"
     try:
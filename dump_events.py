@@ -11,7 +11,7 @@ import pytz
 import json
 from pathlib import Path
 import datetime
-import concurrent.futures
+from functools import partial
 from dateutil.parser import parse as parse_date
 
 import click
@@ -21,13 +21,15 @@ from sentry.eventstore.models import Event
 from sentry import nodestore
 from sentry.utils import snuba
 
-from snuba_sdk.conditions import Condition, Op, Or
+from snuba_sdk.conditions import And, Condition, Op, Or
 from snuba_sdk.orderby import Direction, OrderBy
 from snuba_sdk.query import Column, Entity, Function, Query
 
 import sentry_sdk
 sentry_sdk.init("")
 
+from grouping_tests.fetch import copy_events, iter_pages
+
 @click.command()
 @click.option("--project-id", type=int, help="The project numeric Id, an alternative to project slug")
 @click.option("--org-slug", type=str, help="The organization slug, an alternative to project id, if used must also provide project-slug")
@@ -35,7 +37,7 @@ sentry_sdk.init("")
 @click.option("--file-name", required=True, type=Path, help="File/pipe name to use for dumping the events")
 @click.option("--max-events", type=int, default="1000", help="How many events to import")
 @click.option("--use-pipe/--use-file", type=bool, default=True, help="uses a named pipe instead of a normal file")
-@click.option("--batch-size", type=int, default=200, help="How many events to fetch at once from Snuba and nodestore.")
+@click.option("--batch-size", type=int, default=200, help="How many events to fetch at once from Snuba and nodestore. The next batch is fetched from Snuba while nodestore is busy with the current one.")
 @click.option("--network-threads", default=64, help="How many threads to spawn for fetching")
 def dump_events( project_id: int, org_slug: str, project_slug: str, file_name:Path, max_events:int, use_pipe, batch_size: int, network_threads: int):
     """
@@ -60,16 +62,19 @@ def dump_events( project_id: int, org_slug: str, project_slug: str, file_name:Pa
 
         events_estimate = min(snuba.raw_snql_query(_get_query(project_id, []), referrer="garbage.markus.get-estimate")['data'][0]['count'], max_events)
 
-        chunks = _copy_events(project_id, max_events, output_file, batch_size, network_threads)
-
         # write a header with the number of events (so we can support progress bars downstream)
         _write_doc_separator(output_file)
         json.dump({"max_events": events_estimate},output_file, separators=(',',':'))
 
         print(f"# Dumping roughly {events_estimate} events...")
-        with click.progressbar(chunks, length=max_events) as chunks:
-            for _ in chunks:
-                pass
+        pages = iter_pages(partial(_fetch_page, project_id, datetime.datetime.now()), max_events, batch_size)
+        num_events = 0
+        with click.progressbar(length=events_estimate) as progress_bar:
+            for page_size in copy_events(pages, partial(_load, project_id), partial(_write_event, output_file), network_threads):
+                num_events += page_size
+                progress_bar.update(page_size)
+
+        print(f"# Dumped {num_events} events.")
 
 
 
@@ -94,66 +99,48 @@ def _get_query(project_id, where):
     return query
 
 
-def _load_events(project_id, max_events, output_file, batch_size):
-    from sentry.utils.query import celery_run_batch_query
-
-    state = None
-
-    now = datetime.datetime.now()
-
-    num_events = 0
-
-    while True:
-        where = [Condition(Column("timestamp"), Op.LTE, now)]
-
-        query = _get_query(project_id, where).set_select([
-            Function("argMax", [Column("event_id"), Column("timestamp")], "last_event_id"),
-            Function("max", [Column("timestamp")], "last_timestamp")
-        ]) \
-            .set_limit(min(batch_size, max_events - num_events)) \
-            .set_offset(num_events) \
-            .set_orderby([OrderBy(Column("last_timestamp"), Direction.DESC), OrderBy(Column("last_event_id"), Direction.DESC)]) \
-            .set_groupby([Column("primary_hash")])
-
-        result = snuba.raw_snql_query(query, referrer="garbage.markus.dump-events")['data']
-        if not result:
-            break
-
-        num_events += len(result)
+def _fetch_page(project_id, now, cursor, limit):
+    """ Latest event of each group, continuing after cursor. See iter_pages """
+    last_event_id = Function("argMax", [Column("event_id"), Column("timestamp")], "last_event_id")
+    last_timestamp = Function("max", [Column("timestamp")], "last_timestamp")
 
-        for row in result:
-            yield row['last_event_id']
+    where = [Condition(Column("timestamp"), Op.LTE, now)]
 
-    print(f"# Dumped {num_events} events.")
+    query = _get_query(project_id, where).set_select([last_event_id, last_timestamp]) \
+        .set_limit(limit) \
+        .set_orderby([OrderBy(Column("last_timestamp"), Direction.DESC), OrderBy(Column("last_event_id"), Direction.DESC)]) \
+        .set_groupby([Column("primary_hash")])
 
+    if cursor is not None:
+        timestamp, event_id = cursor
+        query = query.set_having([Or([
+            Condition(last_timestamp, Op.LT, timestamp),
+            And([Condition(last_timestamp, Op.EQ, timestamp), Condition(last_event_id, Op.LT, event_id)]),
+        ])])
 
-def _copy_events(project_id, max_events, output_file, batch_size, max_workers):
+    rows = snuba.raw_snql_query(query, referrer="garbage.markus.dump-events")['data']
+    for row in rows:
+        row['last_timestamp'] = parse_date(row['last_timestamp'])
 
-    def _load(event_id):
-        node_id = Event.generate_node_id(project_id, event_id)
+    return rows
 
-        value = nodestore.backend._get_bytes(node_id)
-        # copied from nodestore impl
-        event_data_raw = next(iter(value.splitlines()))
 
-        return event_data_raw
+def _load(project_id, event_id):
+    node_id = Event.generate_node_id(project_id, event_id)
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-        batch = []
-        for event_id in _load_events(project_id, max_events, output_file, batch_size):
-            batch.append(event_id)
-            yield
+    value = nodestore.backend._get_bytes(node_id)
+    if value is None:
+        return None
 
-            if len(batch) >= batch_size:
-                futures = [executor.submit(_load, event_id) for event_id in batch]
+    # copied from nodestore impl
+    event_data_raw = next(iter(value.splitlines()))
 
-                for future in concurrent.futures.as_completed(futures):
-                    event_data_raw = future.result()
-                    _write_doc_separator(output_file)
-                    output_file.write(event_data_raw.decode("utf8"))
+    return event_data_raw
 
-                batch = []
 
+def _write_event(output_file, event_data_raw):
+    _write_doc_separator(output_file)
+    output_file.write(event_data_raw.decode("utf8"))
 
 
 def _write_doc_separator(file):
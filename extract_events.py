@@ -0,0 +1,64 @@
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Optional, Tuple
+
+import click
+
+from grouping_tests.corpus import CorpusReader, is_corpus
+from grouping_tests.fetch import event_path
+
+
+@click.command()
+@click.option("--event-dir", required=True, type=Path,
+              help="created using store_events.py --segment-size")
+@click.option("--output-dir", type=Path, help="Defaults to --event-dir")
+@click.option("--project", "projects", multiple=True,
+              help="Only extract these projects, e.g. project_1")
+@click.argument("event_ids", nargs=-1)
+def extract_events(event_dir: Path, output_dir: Optional[Path], projects: Tuple[str, ...],
+                   event_ids: Tuple[str, ...]):
+    """ Write events stored in compressed segments as one JSON file per event
+
+    The files are laid out like those written by store_events.py without
+    --segment-size, so links in grouping reports (--events-base-url) work
+    once the events are extracted. Extracts all events if no EVENT_IDS are given.
+
+    Usage example:
+
+        python extract_events.py --event-dir ./events 0a1b2c3d4e5f...
+
+    """
+    if output_dir is None:
+        output_dir = event_dir
+
+    t0 = time.time()
+    num_extracted = 0
+    missing = set(event_ids)
+    for entry in sorted(os.scandir(event_dir), key=lambda e: e.name):
+        project_dir = Path(entry.path)
+        if projects and entry.name not in projects or not is_corpus(project_dir):
+            continue
+
+        reader = CorpusReader(project_dir)
+        for event_id in (event_ids or list(reader.event_ids())):
+            payload = reader.read(event_id)
+            if payload is None:
+                continue
+            output_path = output_dir / entry.name / event_path(event_id)
+            os.makedirs(output_path.parent, exist_ok=True)
+            with open(output_path, 'wb') as output_file:
+                output_file.write(payload)
+            missing.discard(event_id)
+            num_extracted += 1
+        reader.close()
+
+    for event_id in sorted(missing):
+        print("WARNING: Event not found:", event_id, file=sys.stderr)
+
+    print(f"Extracted {num_extracted} events. Time ellapsed: {time.time() - t0}")
+
+
+if __name__ == "__main__":
+    extract_events()  # pylint: disable=no-value-for-parameter
@@ -0,0 +1,101 @@
+from pathlib import Path
+from typing import Dict, IO, List, Optional
+import hashlib
+import json
+import os
+import shutil
+
+
+class BlobStore:
+
+    """ Report-wide, content-addressed store for variant dumps, crash reports etc.
+
+    Many events share byte-identical dumps, within a node as well as across
+    nodes and projects, so every distinct blob is stored only once.
+
+    Blobs are appended to a few bundle files rather than written to one file
+    each, because creating, copying and serving millions of small files is
+    slow. Bundles are sharded by the first digits of the blobs' digests, and
+    the URL of a blob is the URL of its bundle plus its digest, e.g.
+    ``blobs/3f.bundle#3f2a...``. Every bundle has an index of offsets and
+    lengths next to it, e.g. ``blobs/3f.json``. The client fetches a blob
+    with a range request and falls back to loading the whole bundle from
+    servers that ignore ranges (see static/blobs.js).
+
+    URLs only depend on the content, not on the order in which blobs are
+    stored, so pages can be reused from a previous report as they are
+    (see ProjectReport).
+
+    Not thread safe. Only the thread writing project reports stores blobs.
+    """
+
+    #: Number of hex digits of the digest that select the bundle
+    SHARD_DIGITS = 2
+
+    def __init__(self, report_dir: Path):
+        self._blob_dir = report_dir / "blobs"
+        self._files: Dict[str, IO[bytes]] = {}  # By shard
+        self._indexes: Dict[str, Dict[str, List[int]]] = {}  # Offset and length by shard, digest
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    @staticmethod
+    def digest(content: str) -> str:
+        return hashlib.sha1(content.encode()).hexdigest()
+
+    def get_url(self, digest: str) -> Optional[str]:
+        """ Relative to report dir. None if no such blob has been stored """
+        shard = digest[:self.SHARD_DIGITS]
+        if digest not in self._indexes.get(shard, ()):
+            return None
+
+        return self._url(shard, digest)
+
+    def put(self, content: Optional[str], digest: Optional[str] = None) -> Optional[str]:
+        """ Store content if it is not stored yet, return its URL (None if empty)
+
+        Pass the hex digest of content if it is known already.
+        """
+        if not content:
+            return None
+
+        if digest is None:
+            digest = self.digest(content)
+
+        shard = digest[:self.SHARD_DIGITS]
+        index = self._indexes.setdefault(shard, {})
+        if digest not in index:
+            file_ = self._files.get(shard)
+            if file_ is None:
+                os.makedirs(self._blob_dir, exist_ok=True)
+                file_ = self._files[shard] = open(self._blob_dir / f"{shard}.bundle", 'wb')
+            data = content.encode()
+            index[digest] = [file_.tell(), len(data)]
+            file_.write(data)
+
+        return self._url(shard, digest)
+
+    def close(self):
+        for file_ in self._files.values():
+            file_.close()
+        self._files.clear()
+
+        for shard, index in self._indexes.items():
+            with open(self._blob_dir / f"{shard}.json", 'w') as f:
+                json.dump(index, f, separators=(',', ':'))
+
+    @staticmethod
+    def _url(shard: str, digest: str) -> str:
+        return f"blobs/{shard}.bundle#{digest}"
+
+
+def link_or_copy(src: Path, dst: Path):
+    """ Hard link if possible, e.g. if both paths are on the same file system """
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
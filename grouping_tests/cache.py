@@ -0,0 +1,132 @@
+from pathlib import Path
+from typing import Any, Optional
+import hashlib
+import json
+import logging
+import os
+import pickle
+import tempfile
+
+
+LOG = logging.getLogger(__name__)
+
+
+def config_digest(config: dict, *extra: str) -> str:
+    """ Stable digest of a grouping config (including serialized enhancements) """
+    hasher = hashlib.sha1(json.dumps(config, sort_keys=True).encode())
+    for value in extra:
+        hasher.update(value.encode())
+
+    return hasher.hexdigest()
+
+
+class ResultCache:
+
+    """ On-disk, content-addressed cache of per-event grouping results
+
+    Entries are keyed by the digest of the raw event payload combined with the
+    digest of the grouping config, so changing either one results in a miss.
+    Reading and writing is safe from multiple worker processes. Every process
+    evicts entries after writing EVICT_FRACTION of ``max_size``, so a large
+    run exceeds ``max_size`` by at most that much per process.
+    """
+
+    #: Part of every key. Bump whenever the shape of cached results changes,
+    #: e.g. when items get a new field, so old entries are no longer used
+    SCHEMA_VERSION = 1
+
+    #: Fraction of max_size written between evictions, see put()
+    EVICT_FRACTION = 0.1
+
+    def __init__(self, cache_dir: Path, namespace: str, max_size: int):
+        self._cache_dir = cache_dir
+        self._namespace = namespace  # typically the config digest
+        self._max_size = max_size  # bytes
+        self._written = 0  # bytes written since the last eviction
+
+    def key(self, payload: bytes, *extra: str) -> str:
+        hasher = hashlib.sha1(f"{self.SCHEMA_VERSION}:{self._namespace}".encode())
+        for value in extra:
+            hasher.update(value.encode())
+        hasher.update(payload)
+
+        return hasher.hexdigest()
+
+    def get(self, key: str) -> Optional[Any]:
+        """ Return None on cache miss """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            LOG.warning("Removing corrupt cache entry %s: %s", path, e)
+            _remove(path)
+            return None
+
+        # Mark entry as recently used, see evict()
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass  # Evicted concurrently, value is still good
+
+        return value
+
+    def put(self, key: str, value: Any):
+        path = self._path(key)
+        os.makedirs(path.parent, exist_ok=True)
+
+        # Write to temporary file first so readers never see partial entries
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+                self._written += f.tell()
+            os.replace(tmp_path, path)
+        except BaseException:
+            _remove(Path(tmp_path))
+            raise
+
+        if self._written > self._max_size * self.EVICT_FRACTION:
+            self.evict()
+
+    def evict(self):
+        """ Remove least recently used entries until cache fits into max_size """
+        self._written = 0
+        entries = []
+        total_size = 0
+        for dirpath, _, filenames in os.walk(self._cache_dir):
+            for filename in filenames:
+                path = Path(dirpath) / filename
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total_size += stat.st_size
+
+        if total_size <= self._max_size:
+            return
+
+        LOG.info("Evicting cache entries (%s bytes > %s bytes)...", total_size, self._max_size)
+        entries.sort()
+        num_evicted = 0
+        for _, size, path in entries:
+            if total_size <= self._max_size:
+                break
+            _remove(path)
+            total_size -= size
+            num_evicted += 1
+
+        LOG.info("Evicted %s cache entries", num_evicted)
+
+    def _path(self, key: str) -> Path:
+        return self._cache_dir / key[:2] / f"{key}.pickle"
+
+
+def _remove(path: Path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,153 @@
+""" Segmented, compressed storage of event payloads
+
+Alternative to one JSON file per event (see fetch.event_path). Every project
+directory holds segment files and an index::
+
+    project_1/
+        index.bin
+        segment-0000.gz
+        segment-0001.gz
+
+Every event is compressed on its own as a gzip member, so it can be read
+without decompressing its neighbours. A segment is a valid gzip file of
+newline-separated JSON documents, e.g. for ``zcat``. The index holds one
+fixed-size record per event: event ID, segment number, offset and length.
+"""
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional, Tuple
+import gzip
+import json
+import mmap
+import os
+import struct
+
+
+INDEX_NAME = "index.bin"
+
+#: event ID (16 bytes), segment number, offset, length
+INDEX_RECORD = struct.Struct("<16sIQI")
+
+
+def segment_name(segment: int) -> str:
+    return f"segment-{segment:04d}.gz"
+
+
+def is_corpus(project_dir: Path) -> bool:
+    return (project_dir / INDEX_NAME).exists()
+
+
+class CorpusWriter:
+
+    """ Write events to the segments of their projects
+
+    Same interface as fetch.EventWriter. Not thread safe, run it in a single
+    writer thread and close it when done.
+    """
+
+    def __init__(self, output_dir: Path, max_segment_size: int):
+        self._output_dir = output_dir
+        self._max_segment_size = max_segment_size  # bytes
+        self._projects: Dict[str, _ProjectWriter] = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def __call__(self, project_id: str, event_id: str, node: Any):
+        writer = self._projects.get(project_id)
+        if writer is None:
+            writer = self._projects[project_id] = _ProjectWriter(
+                self._output_dir / f"project_{project_id}", self._max_segment_size)
+
+        writer.append(event_id, (json.dumps(node) + "\n").encode())
+
+    def close(self):
+        for writer in self._projects.values():
+            writer.close()
+        self._projects.clear()
+
+
+class _ProjectWriter:
+
+    def __init__(self, project_dir: Path, max_segment_size: int):
+        os.makedirs(project_dir, exist_ok=True)
+        self._project_dir = project_dir
+        self._max_segment_size = max_segment_size
+
+        self._segment = 0
+        self._index = open(project_dir / INDEX_NAME, 'wb')
+        self._file = None
+        self._offset = 0
+
+    def append(self, event_id: str, data: bytes):
+        member = gzip.compress(data, compresslevel=6, mtime=0)
+        if self._file is None or self._offset + len(member) > self._max_segment_size:
+            self._next_segment()
+
+        self._file.write(member)
+        self._index.write(INDEX_RECORD.pack(
+            bytes.fromhex(event_id), self._segment, self._offset, len(member)))
+        self._offset += len(member)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._index.close()
+
+    def _next_segment(self):
+        if self._file is not None:
+            self._file.close()
+            self._segment += 1
+        self._file = open(self._project_dir / segment_name(self._segment), 'wb')
+        self._offset = 0
+
+
+class CorpusReader:
+
+    """ Random access to the events of one project, by memory-mapping its segments """
+
+    def __init__(self, project_dir: Path):
+        self._project_dir = project_dir
+        self._locations: Dict[str, Tuple[int, int, int]] = {}  # By event ID
+        with open(project_dir / INDEX_NAME, 'rb') as index:
+            for event_id, *location in INDEX_RECORD.iter_unpack(index.read()):
+                self._locations[event_id.hex()] = tuple(location)
+
+        self._segments: Dict[int, mmap.mmap] = {}
+
+    def __len__(self):
+        return len(self._locations)
+
+    def event_ids(self) -> Iterator[str]:
+        """ In the order they were written """
+        return iter(self._locations)
+
+    def read(self, event_id: str) -> Optional[bytes]:
+        """ Raw JSON payload of the event, None if it is not in the corpus
+
+        Byte for byte the content of the file fetch.EventWriter writes, so
+        without the newline that separates documents in the segment.
+        """
+        location = self._locations.get(event_id)
+        if location is None:
+            return None
+
+        segment, offset, length = location
+        return gzip.decompress(self._segment(segment)[offset:offset + length]).rstrip(b"\n")
+
+    def close(self):
+        for segment in self._segments.values():
+            segment.close()
+        self._segments.clear()
+
+    def _segment(self, segment: int) -> mmap.mmap:
+        mapped = self._segments.get(segment)
+        if mapped is None:
+            with open(self._project_dir / segment_name(segment), 'rb') as f:
+                mapped = self._segments[segment] = mmap.mmap(
+                    f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        return mapped
@@ -1,11 +1,12 @@
 import json
 import logging
-from typing import List, Optional
+from typing import Dict, List, Optional
 
 from sentry.eventstore.models import Event
 from sentry.lang.native.applecrashreport import AppleCrashReport
 from sentry.utils.safe import get_path
 from sentry.grouping.component import GroupingComponent
+from sentry.grouping.variants import BaseVariant
 
 
 LOG = logging.getLogger(__name__)
@@ -78,12 +79,10 @@ def extract_stacktrace_preview(stacktrace_render):
             return "\n".join(lines[-3:])
     return None
 
-def dump_variants(config, event: Event) -> str:
+def dump_variants(variants: Dict[str, BaseVariant]) -> str:
     # Copied from sentry/tests/sentry/grouping/test_variants.py
     rv: List[str] = []
-    for (key, value) in sorted(
-        event.get_grouping_variants(force_config=config).items()
-    ):
+    for (key, value) in sorted(variants.items()):
         if rv:
             rv.append("-" * 74)
         rv.append("%s:" % key)
@@ -0,0 +1,89 @@
+from collections import Counter, defaultdict
+from typing import Callable, Dict, List, Optional, Set
+
+from grouping_tests.groups.base import GroupNode
+
+
+#: Possible values of GroupDiff.status
+STATUSES = ("unchanged", "split", "merged", "split and merged")
+
+
+class GroupDiff:
+
+    """ Where the events of one baseline group ended up with the new config
+
+    Groups are the children of a project's root node. ``groups`` counts the
+    events of the baseline group per new group. Events which are not in any
+    new group are counted under ``None``.
+    """
+
+    def __init__(self, name: str, title: str, item_count: int, groups: Dict[Optional[str], int]):
+        self.name = name
+        self.title = title
+        self.item_count = item_count
+        self.groups = groups
+        self.merged_with: Set[str] = set()  # Baseline groups sharing a new group with this one
+
+    @property
+    def is_split(self) -> bool:
+        return len(self.groups) > 1
+
+    @property
+    def is_merged(self) -> bool:
+        return bool(self.merged_with)
+
+    @property
+    def status(self) -> str:
+        if self.is_split and self.is_merged:
+            return "split and merged"
+        if self.is_split:
+            return "split"
+        if self.is_merged:
+            return "merged"
+
+        return "unchanged"
+
+    def to_dict(self) -> dict:
+        return {
+            'name': self.name,
+            'title': self.title,
+            'item_count': self.item_count,
+            'status': self.status,
+            'groups': self.groups,
+            'merged_with': sorted(self.merged_with),
+        }
+
+
+def diff_groups(baseline: GroupNode, current: GroupNode,
+                get_title: Callable[[GroupNode], str]) -> List[GroupDiff]:
+    """ Compare the groups of two issue trees built from the same items
+
+    Items are matched by identity, so both trees must share the item objects.
+    Baseline groups are titled by ``get_title``, so they read like in reports.
+    """
+    current_groups = {}
+    for group in current.children.values():
+        for item in _items(group):
+            current_groups[id(item)] = group.name
+
+    diffs = []
+    sources = defaultdict(set)  # Baseline groups by new group
+    for group in baseline.children.values():
+        counts = Counter(current_groups.get(id(item)) for item in _items(group))
+        diffs.append(GroupDiff(group.name, get_title(group), group.total_item_count, dict(counts)))
+        for name in counts:
+            if name is not None:
+                sources[name].add(group.name)
+
+    for diff in diffs:
+        for name in diff.groups:
+            diff.merged_with.update(sources.get(name, ()))
+        diff.merged_with.discard(diff.name)
+
+    return diffs
+
+
+def _items(group: GroupNode):
+    for node, _ in group.nodes():
+        yield from node.items
+
@@ -0,0 +1,213 @@
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, as_completed, wait
+from itertools import islice
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+import json
+import logging
+import os
+import textwrap
+import time
+
+
+LOG = logging.getLogger(__name__)
+
+
+#: (project_id, event_id)
+EventKey = Tuple[str, str]
+
+#: Fetch payloads of a batch of events. Payload is None if not found
+FetchBatch = Callable[[List[EventKey]], Dict[EventKey, Optional[Any]]]
+
+#: (last_timestamp, last_event_id) of the last row of the previous page
+Cursor = Optional[Tuple[Any, str]]
+
+#: Fetch rows with 'last_timestamp' and 'last_event_id' following the cursor
+FetchPage = Callable[[Cursor, int], List[Dict[str, Any]]]
+
+_END = object()
+
+
+def parse_event_keys(lines: Iterable[str]) -> Iterator[EventKey]:
+    """ Parse ``project_id<TAB>event_id`` lines as written by clickhouse-client """
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        project_id, event_id = line.split("\t")
+
+        yield project_id, event_id.replace("-", "")
+
+
+def nodestore_fetcher(nodestore, generate_node_id: Callable[[str, str], str]) -> FetchBatch:
+    """ Fetch a batch of events with a single nodestore.get_multi call """
+    def fetch_batch(keys: List[EventKey]) -> Dict[EventKey, Optional[Any]]:
+        keys_by_node_id = {generate_node_id(*key): key for key in keys}
+        nodes = nodestore.get_multi(list(keys_by_node_id))
+
+        return {key: nodes.get(node_id) for node_id, key in keys_by_node_id.items()}
+
+    return fetch_batch
+
+
+class EventWriter:
+
+    """ Write event payloads to output_dir, see event_path
+
+    Not thread safe. Run it in a single writer thread.
+    """
+
+    def __init__(self, output_dir: Path):
+        self._output_dir = output_dir
+        self._created_dirs: Set[Path] = set()
+
+    def __call__(self, project_id: str, event_id: str, node: Any):
+        output_path = self._output_dir / f"project_{project_id}" / event_path(event_id)
+        if output_path.parent not in self._created_dirs:
+            os.makedirs(output_path.parent, exist_ok=True)
+            self._created_dirs.add(output_path.parent)
+
+        with open(output_path, 'w') as output_file:
+            output_file.write(json.dumps(node))
+
+    def close(self):
+        """ Nothing to flush, see corpus.CorpusWriter """
+
+
+def event_path(event_id: str, prefix_length=2, num_levels=2) -> Path:
+    """ Spread out files by chopping up the event ID """
+    id_parts = textwrap.wrap(event_id, prefix_length)
+    target_dir = Path().joinpath(*id_parts[:num_levels])
+
+    return target_dir / f"event_{event_id}.json"
+
+
+def event_id_from_path(path) -> str:
+    """ Inverse of event_path """
+    return Path(path).stem[len("event_"):]
+
+
+class FetchStats:
+
+    def __init__(self):
+        self.num_stored = 0
+        self.num_missing = 0
+        self.num_batches = 0
+        self.start_time = time.time()
+
+    @property
+    def elapsed(self) -> float:
+        return time.time() - self.start_time
+
+    def __str__(self):
+        rate = self.num_stored / max(self.elapsed, 1e-9)
+        return (
+            f"{self.num_stored} events stored, {self.num_missing} missing, "
+            f"{self.num_batches} batches, {self.elapsed:.1f}s ({rate:.0f} events/s)"
+        )
+
+
+def fetch_events(keys: Iterable[EventKey], fetch_batch: FetchBatch, store: Callable,
+                 batch_size: int, num_workers: int,
+                 on_progress: Callable[[int], None] = lambda _: None) -> FetchStats:
+    """ Fetch events in batches on a pool of threads, store them in a separate writer thread
+
+    Keys are consumed lazily, and at most ``2 * num_workers`` batches are
+    fetched or waiting to be written at any time, so memory stays bounded
+    no matter how many events are fetched.
+    """
+    stats = FetchStats()
+    max_pending = 2 * num_workers
+    keys = iter(keys)
+
+    with ThreadPoolExecutor(num_workers) as fetchers, ThreadPoolExecutor(1) as writer:
+        fetching: Set[Future] = set()
+        writing: List[Future] = []
+
+        def write_batch(results: Dict[EventKey, Optional[Any]]):
+            for (project_id, event_id), node in results.items():
+                if node is None:
+                    LOG.warning(
+                        "Got None from nodestore for project / event %s %s", project_id, event_id)
+                    stats.num_missing += 1
+                else:
+                    store(project_id, event_id, node)
+                    stats.num_stored += 1
+            on_progress(len(results))
+
+        def collect(done: Iterable[Future]):
+            for future in done:
+                fetching.discard(future)
+                writing.append(writer.submit(write_batch, future.result()))
+                stats.num_batches += 1
+
+        while True:
+            batch = list(islice(keys, batch_size))
+            if batch:
+                fetching.add(fetchers.submit(fetch_batch, batch))
+
+            if len(fetching) >= max_pending or (not batch and fetching):
+                done, _ = wait(fetching, return_when=FIRST_COMPLETED)
+                collect(done)
+
+            # Do not let the writer fall behind, and raise its errors early
+            while writing and (writing[0].done() or len(writing) > max_pending):
+                writing.pop(0).result()
+
+            if not batch and not fetching:
+                break
+
+        for future in writing:
+            future.result()
+
+    return stats
+
+
+def iter_pages(fetch_page: FetchPage, max_events: int, page_size: int) -> Iterator[List[str]]:
+    """ Page through event IDs with keyset pagination
+
+    Every page continues after the last row of the previous one, rather than
+    skipping an offset, so the cost of a page does not grow with the number
+    of pages before it. Rows must be ordered by (last_timestamp, last_event_id).
+    """
+    cursor: Cursor = None
+    num_events = 0
+    while num_events < max_events:
+        rows = fetch_page(cursor, min(page_size, max_events - num_events))
+        if not rows:
+            return
+
+        num_events += len(rows)
+        yield [row['last_event_id'] for row in rows]
+
+        cursor = rows[-1]['last_timestamp'], rows[-1]['last_event_id']
+
+
+def prefetch(iterator: Iterator, executor: ThreadPoolExecutor) -> Iterator:
+    """ Compute the next item in the background while the current one is consumed """
+    future = executor.submit(next, iterator, _END)
+    while True:
+        item = future.result()
+        if item is _END:
+            return
+        future = executor.submit(next, iterator, _END)
+        yield item
+
+
+def copy_events(pages: Iterable[List[str]], load_event: Callable[[str], Optional[bytes]],
+                write: Callable[[bytes], None], max_workers: int) -> Iterator[int]:
+    """ Load the events of every page on a pool of threads and write them
+
+    The next page is fetched while the events of the current page are loaded.
+    Yields the number of event IDs handled per page, e.g. for a progress bar.
+    """
+    with ThreadPoolExecutor(1) as page_fetcher, ThreadPoolExecutor(max_workers) as loaders:
+        for event_ids in prefetch(iter(pages), page_fetcher):
+            futures = {loaders.submit(load_event, event_id): event_id for event_id in event_ids}
+            for future in as_completed(futures):
+                event_data_raw = future.result()
+                if event_data_raw is None:
+                    LOG.warning("Got None from nodestore for event %s", futures[future])
+                else:
+                    write(event_data_raw)
+
+            yield len(event_ids)
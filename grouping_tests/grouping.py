@@ -0,0 +1,62 @@
+from typing import Dict, List
+import hashlib
+
+from sentry.eventstore.models import Event
+from sentry.grouping.api import sort_grouping_variants
+from sentry.grouping.component import GroupingComponent
+from sentry.grouping.variants import BaseVariant
+
+from grouping_tests.crash import dump_variants
+
+
+class GroupingResult:
+
+    """ Grouping variants of one event, sorted for hashing and dumped for the report
+
+    Running the grouping strategy is the most expensive step per event, so it
+    runs once and every view is derived from the same variants.
+    """
+
+    def __init__(self, variants: Dict[str, BaseVariant]):
+        self.variants = variants
+        self.flat: List[BaseVariant]
+        self.hierarchical: List[BaseVariant]
+        self.flat, self.hierarchical = sort_grouping_variants(variants)
+
+    def dump(self) -> str:
+        return dump_variants(self.variants)
+
+    def digest(self) -> str:
+        """ Hex digest of everything dump() shows, without rendering the dump
+
+        Events with the same digest have the same dump, so with --two-phase
+        only one of them needs to be dumped.
+        """
+        parts: List[str] = []
+        for name, variant in sorted(self.variants.items()):
+            parts += ["variant", name, repr(variant.get_hash())]
+            for key, value in sorted(variant.__dict__.items()):
+                if key == "config":
+                    continue  # Not dumped either
+                parts.append(key)
+                if isinstance(value, GroupingComponent):
+                    _component_parts(value, parts)
+                else:
+                    parts.append(repr(value))
+
+        return hashlib.sha1("\0".join(parts).encode()).hexdigest()
+
+
+def _component_parts(component: GroupingComponent, parts: List[str]):
+    parts += ["(", component.id, repr(component.contributes), repr(component.hint)]
+    for value in component.values:
+        if isinstance(value, GroupingComponent):
+            _component_parts(value, parts)
+        else:
+            parts.append(repr(value))
+    parts.append(")")
+
+
+def evaluate_grouping(event: Event, config) -> GroupingResult:
+    """ Like event.get_sorted_grouping_variants, but keeps the variants by name """
+    return GroupingResult(event.get_grouping_variants(force_config=config))
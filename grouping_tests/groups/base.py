@@ -1,13 +1,42 @@
 from collections import namedtuple
-from typing import Any, Dict, List
+from types import MappingProxyType
+from typing import Any, Callable, Dict, List, Mapping, Optional, Sequence, Tuple
+import hashlib
+import heapq
 
 
 HashData = namedtuple('HashData', ('hash', 'label'))
 
+_NO_CHILDREN: Mapping[str, 'GroupNode'] = MappingProxyType({})
+
 
 class GroupNode:
 
-    """ Group of events. Subclasses differ in the way they insert / merge events """
+    """ Group of events. Subclasses differ in the way they insert / merge events
+
+    There can be millions of nodes, most of them leaves, so containers and
+    inserters are only created once they are needed.
+
+    If ``max_items`` is set, nodes keep a sample of at most that many items,
+    see add_item. Item counts are exact either way.
+
+    The exemplar of a node is the item of its subtree that comes first by
+    priority (see _priority and _precedes), so it does not depend on the
+    order in which items arrive, and it is never left out of a sample.
+    """
+
+    __slots__ = (
+        'name', 'label', 'total_item_count', 'items', 'exemplar', 'index_id', 'fingerprint',
+        '_exemplar_priority', '_item_count', '_heap', '_children', '_flat_inserter',
+        '_tree_inserter',
+    )
+
+    #: Maximum number of items kept per node. Set once, before building any tree
+    max_items: Optional[int] = None
+
+    #: Called with every item that sampling drops, e.g. to free its storage.
+    #: Dropped items are never exemplars, so nothing refers to them anymore
+    on_drop: Optional[Callable[[Any], None]] = None
 
     def __init__(self, name: str, label: str):
 
@@ -15,63 +44,297 @@ class GroupNode:
         self.label = label
 
         self.total_item_count = 0  # Sum of items in self + descendants
-        self.items: List[Any] = []
-        self.children: Dict[str, GroupNode] = {}
+        self.items: Sequence[Any] = ()  # Becomes a list on first item
+        self._item_count = 0  # Can be more than len(items), see add_item
+        self._heap: Optional[List[Tuple[int, int, int]]] = None  # See _sample
+        self._children: Optional[Dict[str, GroupNode]] = None
 
         self.exemplar = None  # Item representing this node
+        self._exemplar_priority: Optional[int] = None
+        self.index_id: Optional[int] = None  # Set by ProjectReport
+        self.fingerprint: Optional[str] = None  # See update_fingerprints
 
-        # Prevent circular import:
-        # pylint: disable=import-outside-toplevel
-        from .flat import FlatInserter
-        from .tree import TreeInserter
+        self._flat_inserter = None
+        self._tree_inserter = None
 
-        self._flat_inserter = FlatInserter(self)
-        self._tree_inserter = TreeInserter(self)
+    @property
+    def item_count(self) -> int:
+        return self._item_count
 
     @property
-    def item_count(self):
-        return len(self.items)
+    def is_sampled(self) -> bool:
+        """ True if not all items of this node are kept """
+        return self._item_count > len(self.items)
+
+    @property
+    def children(self) -> Mapping[str, 'GroupNode']:
+        return _NO_CHILDREN if self._children is None else self._children
+
+    def get_child(self, name: str, label: str) -> 'GroupNode':
+        """ Get child by name, create it if it does not exist yet """
+        if self._children is None:
+            self._children = {}
+
+        child = self._children.get(name)
+        if child is None:
+            child = self._children[name] = GroupNode(name, label)
+
+        return child
+
+    def add_item(self, item):
+        self._item_count += 1
+        if not self.items:
+            self.items = [item]
+        elif self.max_items is None or len(self.items) < self.max_items:
+            self.items.append(item)
+        else:
+            self._sample(item)
+
+    def merge(self, other: 'GroupNode'):
+        """ Move the items and children of another node into this one
+
+        The longer of the two item lists is kept and extended by the shorter
+        one, so no item is moved more than once per doubling of its group.
+        Children with the same name are merged recursively.
+        """
+        if len(other.items) > len(self.items):
+            self.items, other.items = other.items, self.items
+        if other.items:
+            self.items.extend(other.items)
+            other.items = ()
+
+        self._item_count += other._item_count
+        other._item_count = 0
+        self._heap = other._heap = None
+        if self.max_items is not None and len(self.items) > self.max_items:
+            # Both samples hold the items with the lowest priorities,
+            # so the merged sample is made up of the lowest of both
+            items = self.items
+            self.items = heapq.nsmallest(
+                self.max_items, items, key=lambda item: (_priority(item), id(item)))
+            kept = {id(item) for item in self.items}
+            for item in items:
+                if id(item) not in kept:
+                    _drop(item)
+
+        if other.exemplar is not None:
+            self._set_exemplar(other.exemplar, other._exemplar_priority)
+        self.total_item_count += other.total_item_count
+        other.total_item_count = 0
+
+        for name, child in other.children.items():
+            if self._children is None:
+                self._children = {}
+            own_child = self._children.setdefault(name, child)
+            if own_child is not child:
+                own_child.merge(child)
+        other._children = None
+
+    def insert_hierarchical(self, hashes: List[HashData], item,
+                            priority: Optional[int] = None):
+        """ Interpret hashes as path in issue tree
+
+        Pass the item's priority (see _priority) if it is known already.
+        """
+        if priority is None:
+            priority = _priority(item)
+        if not hashes:
+            self.add_item(item)
+        else:
+            if self._tree_inserter is None:
+                # Prevent circular import:
+                # pylint: disable=import-outside-toplevel
+                from .tree import TreeInserter
+                self._tree_inserter = TreeInserter(self)
+            self._tree_inserter.insert(hashes, item, priority)
+        self._update(item, priority)
+
+    def insert_flat(self, hashes: List[HashData], item, priority: Optional[int] = None):
+        """ Interpret hashes as path in issue tree
+
+        Pass the item's priority (see _priority) if it is known already.
+        """
+        if priority is None:
+            priority = _priority(item)
+        if not hashes:
+            self.add_item(item)
+        else:
+            if self._flat_inserter is None:
+                # Prevent circular import:
+                # pylint: disable=import-outside-toplevel
+                from .flat import FlatInserter
+                self._flat_inserter = FlatInserter(self)
+            self._flat_inserter.insert(hashes, item, priority)
+        self._update(item, priority)
+
+    def nodes(self, ancestors: Optional[List['GroupNode']] = None):
+        """ Iterate nodes in a depth-first manner
+
+        Yields every node along with its ancestors, prefixed by ``ancestors``.
+        The list of ancestors is shared between iterations, so copy it if
+        you need to keep it.
+        """
+        ancestors = list(ancestors or ())
+        stack = [iter((self, ))]
+        while stack:
+            node = next(stack[-1], None)
+            if node is None:
+                # All children visited
+                stack.pop()
+                if stack:
+                    ancestors.pop()
+                continue
+
+            yield node, ancestors
 
-    def insert_hierarchical(self, hashes: List[HashData], item):
-        """ Interpret hashes as path in issue tree """
-        self._tree_inserter.insert(hashes, item)
-        self._update(item)
+            if node.children:
+                ancestors.append(node)
+                stack.append(iter(node.children.values()))
 
-    def insert_flat(self, hashes: List[HashData], item):
-        """ Interpret hashes as path in issue tree """
-        self._flat_inserter.insert(hashes, item)
-        self._update(item)
+    def __reduce__(self):
+        """ Pickle the subtree as a flat list of nodes
 
-    def nodes(self, ancestors=None):
-        """ Iterate nodes in a depth-first manner """
-        if ancestors is None:
-            ancestors = []
-        yield self, ancestors
+        Pickling nested nodes recurses once per tree level, which fails for
+        deep trees. Inserters are left out, so do not insert into an
+        unpickled tree.
+        """
+        return _unpack_subtree, (_pack_subtree(self), )
 
-        for child in self.children.values():
-            yield from child.nodes(ancestors + [self])
+    def update_fingerprints(self, digest_node: Callable[['GroupNode'], bytes]):
+        """ Set the fingerprint of every node in the subtree
 
-    def _update(self, item):
+        Like in a Merkle tree, a fingerprint covers the node's name, label
+        and ``digest_node(node)`` as well as the fingerprints of its children,
+        so it changes whenever anything in the subtree changes.
+        """
+        # Reversed depth-first order visits children before their parents
+        for node, _ in reversed(list(self.nodes())):
+            digest = hashlib.sha1(f"{node.name}\0{node.label}\0".encode())
+            digest.update(digest_node(node))
+            for name in sorted(node.children):
+                digest.update(node.children[name].fingerprint.encode())
+            node.fingerprint = digest.hexdigest()
+
+    def _sample(self, item):
+        """ Deterministic reservoir sampling: keep the items with the lowest priority
+
+        Priorities are derived from the items themselves (see _priority), so
+        the sample does not depend on the order in which items arrive.
+        """
+        if self._heap is None:
+            # Max-heap of (priority, identity, index into items), see _precedes
+            self._heap = [
+                (-_priority(kept), -id(kept), index) for index, kept in enumerate(self.items)]
+            heapq.heapify(self._heap)
+
+        priority = _priority(item)
+        max_priority, max_id, index = self._heap[0]
+        if (priority, id(item)) < (-max_priority, -max_id):
+            _drop(self.items[index])
+            self.items[index] = item
+            heapq.heapreplace(self._heap, (-priority, -id(item), index))
+        else:
+            _drop(item)
+
+    def _update(self, item, priority: int):
         """ Keep track of representative and item count """
-        if self.exemplar is None:
+        self._set_exemplar(item, priority)
+        self.total_item_count += 1
+
+    def _set_exemplar(self, item, priority: int):
+        if self._exemplar_priority is None or _precedes(
+                item, priority, self.exemplar, self._exemplar_priority):
             self.exemplar = item
+            self._exemplar_priority = priority
 
-        self.total_item_count += 1
+
+#: What is pickled of every node, see GroupNode.__reduce__
+_PICKLED_SLOTS = (
+    'name', 'label', 'total_item_count', 'items', 'exemplar', 'index_id', 'fingerprint',
+    '_exemplar_priority', '_item_count',
+)
+
+
+def _pack_subtree(root: GroupNode) -> List[tuple]:
+    """ Position of the parent, followed by _PICKLED_SLOTS, for every node in depth-first order """
+    positions: Dict[int, int] = {}
+    rows = []
+    for node, ancestors in root.nodes():
+        positions[id(node)] = len(rows)
+        parent = positions[id(ancestors[-1])] if ancestors else -1
+        rows.append((parent, ) + tuple(getattr(node, slot) for slot in _PICKLED_SLOTS))
+
+    return rows
+
+
+def _unpack_subtree(rows: List[tuple]) -> GroupNode:
+    nodes: List[GroupNode] = []
+    for parent, *values in rows:
+        node = GroupNode(values[0], values[1])
+        for slot, value in zip(_PICKLED_SLOTS, values):
+            setattr(node, slot, value)
+        if parent >= 0:
+            parent_node = nodes[parent]
+            if parent_node._children is None:  # pylint: disable=protected-access
+                parent_node._children = {}  # pylint: disable=protected-access
+            parent_node._children[node.name] = node  # pylint: disable=protected-access
+        nodes.append(node)
+
+    return nodes[0]
+
+
+def _drop(item):
+    if GroupNode.on_drop is not None:
+        GroupNode.on_drop(item)  # pylint: disable=not-callable
+
+
+def _precedes(item, priority: int, other, other_priority: int) -> bool:
+    """ Order of items for exemplars and samples
+
+    Repeated event IDs share a priority, so ties are broken by identity.
+    Otherwise a sample could drop an exemplar that ties with a kept item.
+    """
+    return priority < other_priority or (priority == other_priority and id(item) < id(other))
+
+
+def _priority(item) -> int:
+    """ Pseudo-random, but the same for the same event in every run """
+    digest = hashlib.blake2b(str(item['event_id']).encode(), digest_size=8).digest()
+
+    return int.from_bytes(digest, 'big')
 
 
 class Inserter:
 
     """ Insertion strategy for a GroupNode """
 
+    __slots__ = ('_node', )
+
     def __init__(self, node: GroupNode):
 
         self._node = node
 
     def _get_child(self, name: str, label: str) -> 'GroupNode':
-        children = self._node.children
-        if name not in children:
-            child = children[name] = GroupNode(name, label)
-        else:
-            child = children[name]
+        return self._node.get_child(name, label)
+
+    # pylint: disable=protected-access
+
+    def _remove_child(self, child: 'GroupNode'):
+        del self._node._children[child.name]
+
+    def _rename_child(self, child: 'GroupNode', name: str) -> 'GroupNode':
+        """ Return the renamed child, or the child it was merged into on a name collision
+
+        Flat and hierarchical groups share the node's children, so a group can
+        be renamed to the name of a hierarchical child.
+        """
+        self._remove_child(child)
+        existing = self._node._children.get(name)
+        if existing is not None:
+            existing.merge(child)
+            return existing
+
+        child.name = name
+        self._node._children[name] = child
 
         return child
@@ -1,51 +1,94 @@
-from typing import List
-import logging
+from typing import Dict, List
 
-from .base import HashData, Inserter
+from .base import GroupNode, HashData, Inserter
 
 
-LOG = logging.getLogger(__name__)
+class FlatInserter(Inserter):
 
+    """ Represents a flat list of event groups
 
-class FlatInserter(Inserter):
+    Hashes occurring in the same event belong to the same group, transitively.
+    Hashes are kept in a disjoint-set forest, so the resulting groups do not
+    depend on the order in which events are inserted. Every group is named
+    after its smallest hash, which makes names order-independent as well.
+    """
 
-    """ Represents a flat list of event groups """
+    __slots__ = ('_parents', '_sizes', '_names', '_groups')
 
     def __init__(self, *args, **kwargs):
 
         super(FlatInserter, self).__init__(*args, **kwargs)
 
-        #: Lookup groups by hash. Values can occur multiple times
-        self._lookup = {}
+        #: Parent of every hash in the forest. Roots are their own parents
+        self._parents: Dict[str, str] = {}
+        #: Number of hashes in the set, by root
+        self._sizes: Dict[str, int] = {}
+        #: Smallest hash in the set, by root
+        self._names: Dict[str, str] = {}
+        #: Group node of the set, by root. Not every set has one yet
+        self._groups: Dict[str, GroupNode] = {}
 
-    def insert(self, flat_hashes: List[HashData], item):
+    def insert(self, flat_hashes: List[HashData], item, priority: int):
         """ Events with overlapping hashes are grouped together """
 
         if not flat_hashes:
             # End of recursion
-            self._node.items.append(item)
-        else:
-            candidates = self._candidates(flat_hashes)
-            if candidates:
-                # Add event to exising group
-                group, *tail = candidates
-                if tail:
-                    LOG.warning("Multiple group candidates for item %s", item)
+            self._node.add_item(item)
+            return
+
+        root = None
+        for d in flat_hashes:
+            other = self._find(d.hash)
+            root = other if root is None else self._union(root, other)
+
+        group = self._groups.get(root)
+        if group is None:
+            # Add event to a new group
+            group = self._groups[root] = self._get_child(self._names[root], None)
+
+        # Call the GroupNode for bookkeeping
+        group.insert_flat([], item, priority)
+
+    def _find(self, hash_: str) -> str:
+        """ Root of the set containing hash, with path compression """
+        parents = self._parents
+        root = parents.setdefault(hash_, hash_)
+        if root == hash_:
+            self._sizes.setdefault(hash_, 1)
+            self._names.setdefault(hash_, hash_)
+            return root
+
+        while parents[root] != root:
+            root = parents[root]
+
+        while parents[hash_] != root:
+            parents[hash_], hash_ = root, parents[hash_]
+
+        return root
+
+    def _union(self, root: str, other: str) -> str:
+        """ Merge two sets (and their groups), return the new root """
+        if root == other:
+            return root
+
+        # Union by size keeps the trees shallow
+        if self._sizes[root] < self._sizes[other]:
+            root, other = other, root
+
+        self._parents[other] = root
+        self._sizes[root] += self._sizes.pop(other)
+        name = self._names[root] = min(self._names[root], self._names.pop(other))
+
+        group = self._groups.get(root)
+        other_group = self._groups.pop(other, None)
+        if other_group is not None:
+            if group is None:
+                group = self._groups[root] = other_group
             else:
-                # Add event to a new group
-                name = "-".join(d.hash for d in flat_hashes)
-                group = self._get_child(name, None)
-                for d in flat_hashes:
-                    self._lookup[d.hash] = group
-
-            # Call the GroupNode for bookkeeping
-            group.insert_flat([], item)
-
-    def _candidates(self, flat_hashes: List[HashData]):
-        # Use a dict to prevent duplicates
-        candidates = {
-            id(self._lookup[d.hash]): self._lookup[d.hash]
-            for d in flat_hashes if d.hash in self._lookup
-        }
-
-        return candidates.values()
+                self._remove_child(other_group)
+                group.merge(other_group)
+
+        if group is not None and group.name != name:
+            self._groups[root] = self._rename_child(group, name)
+
+        return root
@@ -0,0 +1,117 @@
+from collections.abc import MutableMapping
+from typing import Any, Dict, Iterator, List
+
+
+_MISSING = object()
+
+
+class RecordStore:
+
+    """ Column-oriented storage for event items
+
+    Keeping millions of items as dicts is expensive: every dict carries its
+    own hash table with the same keys, and values like titles and culprits
+    repeat over and over. Instead, every field is stored in its own column,
+    and short strings are interned, so repeated values are stored only once.
+    """
+
+    #: Longer strings (dumps, crash reports) rarely repeat, so don't intern them
+    MAX_INTERNED_LENGTH = 256
+
+    def __init__(self):
+        self._columns: Dict[str, List[Any]] = {}
+        self._strings: Dict[str, str] = {}
+        self._size = 0
+        self._free: List[int] = []  # Rows of removed items, reused by add
+
+    def __len__(self):
+        return self._size - len(self._free)
+
+    def add(self, item: dict) -> 'Record':
+        """ Store item and return a dict-like view of it """
+        if self._free:
+            index = self._free.pop()
+        else:
+            index = self._size
+            self._size += 1
+            for column in self._columns.values():
+                column.append(_MISSING)
+
+        for key, value in item.items():
+            self.set(index, key, value)
+
+        return Record(self, index)
+
+    def remove(self, index: int):
+        """ Free the row of an item. Views of it must not be used anymore """
+        for column in self._columns.values():
+            column[index] = _MISSING
+        self._free.append(index)
+
+    def get(self, index: int, key: str) -> Any:
+        """ Return _MISSING if the field is not set """
+        column = self._columns.get(key)
+
+        return _MISSING if column is None else column[index]
+
+    def set(self, index: int, key: str, value: Any):
+        column = self._columns.get(key)
+        if column is None:
+            column = self._columns[key] = [_MISSING] * self._size
+
+        if isinstance(value, str) and len(value) <= self.MAX_INTERNED_LENGTH:
+            value = self._strings.setdefault(value, value)
+
+        column[index] = value
+
+    def keys(self, index: int) -> List[str]:
+        return [
+            key for key, column in self._columns.items()
+            if column[index] is not _MISSING
+        ]
+
+
+class Record(MutableMapping):
+
+    """ Dict-like view of a single item in a RecordStore
+
+    Pickles as a plain dict, so sending a subtree to a worker does not send
+    the entire store along.
+    """
+
+    __slots__ = ('_store', '_index')
+
+    def __init__(self, store: RecordStore, index: int):
+        self._store = store
+        self._index = index
+
+    def __getitem__(self, key: str) -> Any:
+        value = self._store.get(self._index, key)
+        if value is _MISSING:
+            raise KeyError(key)
+
+        return value
+
+    def __setitem__(self, key: str, value: Any):
+        self._store.set(self._index, key, value)
+
+    def __delitem__(self, key: str):
+        if key not in self:
+            raise KeyError(key)
+        self._store.set(self._index, key, _MISSING)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._store.keys(self._index))
+
+    def __len__(self):
+        return len(self._store.keys(self._index))
+
+    def __reduce__(self):
+        return dict, (dict(self), )
+
+    def remove(self):
+        """ Remove the item from its store """
+        self._store.remove(self._index)
+
+    def __repr__(self):
+        return f"Record({dict(self)!r})"
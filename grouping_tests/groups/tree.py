@@ -4,11 +4,14 @@ from .base import HashData, Inserter
 
 class TreeInserter(Inserter):
 
-    def insert(self, hierarchical_hashes: List[HashData], item):
+    __slots__ = ()
+
+    def insert(self, hierarchical_hashes: List[HashData], item, priority: int):
         """ Event hashes are interpreted as a path down a tree of event groups """
-        if hierarchical_hashes:
-            head, *tail = hierarchical_hashes
-            self._get_child(head.hash, head.label).insert_hierarchical(tail, item)
-        else:
-            # We have reached our destination
-            self._node.items.append(item)
+        node = self._node
+        for hash_data in hierarchical_hashes:
+            node = node.get_child(hash_data.hash, hash_data.label)
+            node._update(item, priority)  # pylint: disable=protected-access
+
+        # We have reached our destination
+        node.add_item(item)
@@ -1,20 +1,33 @@
+from collections import Counter
+from functools import lru_cache
+from itertools import islice
 from pathlib import Path
-from typing import List
+from typing import Dict, Iterable, List, Optional
+import hashlib
 import json
 import logging
 import os
 import shutil
 
-import click
 from django.conf import settings
-from django.template.loader import render_to_string
+from django.template import Context
+from django.template.base import Template
+from django.template.loader import get_template
 
+from grouping_tests.blobs import BlobStore, link_or_copy
 from grouping_tests.groups.base import GroupNode
 from grouping_tests.crash import extract_stacktrace_preview
+from grouping_tests.diff import STATUSES, diff_groups
+from grouping_tests.stats import STATS
 
 
 LOG = logging.getLogger(__name__)
 
+#: Stands in for the event list in group-node.html, see _render_to_file
+ROWS_MARKER = "<!-- event rows -->"
+ROWS_TEMPLATE = "event-rows.html"
+ROWS_PER_CHUNK = 500
+
 
 # HACK: add template dir to Django settings
 settings.TEMPLATES[0]['DIRS'] = (
@@ -24,16 +37,35 @@ settings.TEMPLATES[0]['DIRS'] = (
 
 class HTMLReport:
 
-    def __init__(self, parent_dir: Path, metadata, projects: List[str]):
+    def __init__(self, parent_dir: Path, metadata, projects: List[str],
+                 comparison: bool = False, stats: Optional[dict] = None):
 
         self._copy_static_files(parent_dir)
 
         _render_to_file("report.html", parent_dir / "index.html", {
             'projects': sorted(projects),
+            'comparison': comparison,
+            'stats': stats is not None,
             'metadata': json.dumps(metadata, indent=4),
             'report_dir': parent_dir.stem,
         })
 
+        if stats is not None:
+            self._write_stats(parent_dir, stats)
+
+    @staticmethod
+    def _write_stats(parent_dir: Path, stats: dict):
+        total = sum(seconds for _, seconds in stats['timers'].values()) or 1
+        timers = sorted(stats['timers'].items(), key=lambda timer: -timer[1][1])
+        _render_to_file("stats.html", parent_dir / "stats.html", {
+            'report_dir': parent_dir.stem,
+            'timers': [
+                (name, calls, seconds, 1000 * seconds / calls, 100 * seconds / total)
+                for name, (calls, seconds) in timers
+            ],
+            'counters': sorted(stats['counters'].items()),
+        })
+
     @staticmethod
     def _copy_static_files(parent_dir: Path):
         src = Path(__file__).parent / "static"
@@ -42,39 +74,140 @@ class HTMLReport:
         shutil.copytree(src, dst)
 
 
+class ComparisonReport:
+
+    """ Which groups of the baseline config were split or merged by the current config """
+
+    def __init__(self, baseline: GroupNode, current: GroupNode, parent_dir: Path):
+        diffs = diff_groups(baseline, current, _node_title)
+        project_dir = parent_dir / current.name
+
+        with open(project_dir / "comparison.json", 'w') as f:
+            json.dump([diff.to_dict() for diff in diffs], f)
+
+        counts = Counter(diff.status for diff in diffs)
+        titles = {name: _node_title(node) for name, node in current.children.items()}
+        changed = sorted(
+            (diff for diff in diffs if diff.status != "unchanged"),
+            key=lambda diff: (-diff.item_count, diff.name)
+        )
+        _render_to_file("comparison.html", project_dir / "comparison.html", {
+            'report_dir': parent_dir.stem,
+            'title': f"{current.name}: Comparison",
+            'project': current.name,
+            'home': "../",
+            'num_groups': len(diffs),
+            'num_current_groups': len(current.children),
+            'counts': [(status, counts[status]) for status in STATUSES],
+            'changed': [
+                (diff, sorted(
+                    ((name, titles.get(name), count) for name, count in diff.groups.items()),
+                    key=lambda group: -group[2]
+                ))
+                for diff in changed
+            ],
+        })
+
+
 class ProjectReport:
 
-    def __init__(self, root: GroupNode, parent_dir: Path, events_base_url: str):
+    """ HTML pages for every node of a project
+
+    With ``previous_dir``, subtrees whose pages would come out the same as in
+    the previous report are linked from there instead of being rendered. The
+    key of a subtree covers the fingerprint of its root node (see
+    GroupNode.update_fingerprints) and everything its pages show about their
+    ancestors. Keys are stored in each project's ``fingerprints.json``.
+    """
+
+    def __init__(self, root: GroupNode, parent_dir: Path, events_base_url: str,
+                 blobs: BlobStore, pool=None, num_workers: int = 1,
+                 previous_dir: Optional[Path] = None):
         self._root_dir = parent_dir
         self._events_base_url = events_base_url
+        self._previous_dir = previous_dir
         self._current_depth = 0
 
-        # Add a full label path for each node
-        set_labels(root)
-
         # Generate stacktrace previews:
         for node, _ in root.nodes():
             item = node.exemplar or {}
             if 'stacktrace_render' in item and 'stacktrace_preview' not in item:
                 item['stacktrace_preview'] = extract_stacktrace_preview(item['stacktrace_render'])
 
-        # Write grouping variants to disk for each event
-        LOG.info("Project %s: Writing event data...", root.name)
-        with click.progressbar(length=root.total_item_count) as progress_bar:
-            for node, ancestors in root.nodes():
-                self._write_event_data(node, ancestors, progress_bar.update)
-
-        # Create HTML page for each node
+        # Pages refer to the variant dumps of other nodes, so store all blobs
+        # before rendering anything
+        with STATS.timer("store blobs"):
+            self._store_blobs(root, blobs)
+
+        # Pages load the issue tree from this shared index
+        LOG.info("Project %s: Writing tree index...", root.name)
+        with STATS.timer("write tree index"):
+            self._write_tree_index(root)
+
+        self._context_digest = self._get_context_digest(events_base_url)
+        root.update_fingerprints(_node_digest)
+        previous = _keys_by_child(self._load_keys(root)) if previous_dir else {}
+
+        # Write HTML page for each node. Except for the root,
+        # every page only depends on its own subtree, so the root's children
+        # can be rendered independently.
+        # Reports are written in the background while events are still being
+        # grouped, so progress is logged rather than shown in a second progress bar
         LOG.info("Project %s: Writing HTML report...", root.name)
-        with click.progressbar(length=root.total_item_count) as progress_bar:
-            for node, ancestors in root.nodes():
-                self._render_node(node, ancestors, progress_bar.update)
+        keys = {root.name: self._subtree_key(root, [])}
+        self._render_node(root, [])
+
+        # Only the root's name and label are needed to render descendants
+        root_stub = GroupNode(root.name, root.label)
+        tasks = [
+            (self, root_stub, shard, _merge(previous.get(child.name, {}) for child in shard))
+            # A few shards per worker, so they finish at about the same time
+            for shard in _shards(root, 4 * num_workers if pool else 1)
+        ]
+        results = pool.imap_unordered(_render_shard, tasks) if pool else map(_render_shard, tasks)
+        rendered_count = 0
+        for i, (item_count, shard_keys, stats) in enumerate(results):
+            rendered_count += item_count
+            LOG.info("Project %s: Rendered %s/%s shards, %s/%s events", root.name, i + 1,
+                     len(tasks), rendered_count, root.total_item_count)
+            keys.update(shard_keys)
+            STATS.merge(stats)
+
+        with open(self._root_dir / root.name / KEYS_FILENAME, 'w') as f:
+            json.dump(keys, f, separators=(',', ':'))
+
+    def render_subtree(self, subtree: GroupNode, ancestors: List[GroupNode],
+                       previous: Dict[str, str]) -> Dict[str, str]:
+        """ Write HTML page for each node in subtree, return the key of each node by path
+
+        Subtrees with the same key in ``previous`` are linked from the previous report.
+        """
+        keys = {}
+        reused_depth = None  # Depth of the subtree currently being skipped
+        for node, node_ancestors in subtree.nodes(ancestors):
+            depth = len(node_ancestors)
+            if reused_depth is not None and depth <= reused_depth:
+                reused_depth = None
+
+            path = _node_path(node, node_ancestors)
+            key = keys[path] = self._subtree_key(node, node_ancestors)
+            if reused_depth is not None:
+                continue
+
+            if previous.get(path) == key:
+                self._link_previous(path)
+                STATS.count("subtrees reused")
+                reused_depth = depth
+            else:
+                self._render_node(node, node_ancestors)
+
+        return keys
 
-    def _render_node(self, node: GroupNode, ancestors: List[GroupNode], update_fn):
+    def _render_node(self, node: GroupNode, ancestors: List[GroupNode]):
         output_path = self._html_path(node, ancestors)
 
+        # Pages must not contain the report dir, so the next report can reuse them
         _render_to_file("group-node.html", output_path, {
-            'report_dir': self._root_dir.stem,
             'title': _node_title(node),
             'subtitle': _node_subtitle(node),
             'hash': _node_hash(node),
@@ -84,11 +217,16 @@ class ProjectReport:
                 for i, ancestor in enumerate(reversed(ancestors))
             ]),
             'home': (len(ancestors) + 1) * "../",
-            'descendants': _get_descendants(node, []),  # Skip self
+            'tree_index_url': _tree_index_url(ancestors[0] if ancestors else node),
+            'node_path': "/".join(_node_path(node, ancestors).split("/")[1:]),
+            'modals': [
+                ("Crash Report", 'crash_report', _get_field(node, 'crash_report_url')),
+                ("Stacktrace Render", 'stacktrace_render',
+                 _get_field(node, 'stacktrace_render_url')),
+                ("Variants", 'dump_variants', _get_field(node, 'dump_variants_url')),
+            ],
             'events_base_url': self._events_base_url,
-            'tree_chart_data': json.dumps(_node_to_d3(node)),
-            'event_iterator': UpdatingIterator(node.items, update_fn)
-        })
+        }, rows=node.items)
 
     def _output_path(self, node: GroupNode, ancestors: List[GroupNode]):
         path = [ancestor.name for ancestor in ancestors] + [node.name]
@@ -98,60 +236,214 @@ class ProjectReport:
     def _html_path(self, node: GroupNode, ancestors: List[GroupNode]):
         return self._output_path(node, ancestors) / "index.html"
 
-    def _rel_url(self, node: GroupNode, ancestors: List[GroupNode]):
-        path = [ancestor.name for ancestor in ancestors] + [node.name]
+    def _subtree_key(self, node: GroupNode, ancestors: List[GroupNode]) -> str:
+        digest = hashlib.sha1(self._context_digest.encode())
+        for ancestor in ancestors:
+            digest.update(json.dumps(
+                [ancestor.name, _node_title(ancestor), _breadcrumb(ancestor)]).encode())
+        digest.update(node.fingerprint.encode())
+
+        return digest.hexdigest()
+
+    @staticmethod
+    def _get_context_digest(events_base_url: str) -> str:
+        """ Everything that all pages of the report depend on """
+        digest = hashlib.sha1(json.dumps(events_base_url).encode())
+        for path in sorted((Path(__file__).parent / "templates").iterdir()):
+            digest.update(path.read_bytes())
+
+        return digest.hexdigest()
+
+    def _load_keys(self, root: GroupNode) -> Dict[str, str]:
+        try:
+            with open(self._previous_dir / root.name / KEYS_FILENAME) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            LOG.warning("Project %s: Not found in previous report", root.name)
+            return {}
+
+    def _link_previous(self, path: str):
+        shutil.copytree(self._previous_dir / path, self._root_dir / path,
+                        copy_function=link_or_copy, dirs_exist_ok=True)
+
+    @staticmethod
+    def _store_blobs(root: GroupNode, blobs: BlobStore):
+        """ Move variant dumps etc. to the blob store, keep their URLs instead
+
+        This also keeps them from being sent to render workers.
+        """
+        for node, _ in root.nodes():
+            exemplar = node.exemplar
+            if exemplar is not None and 'crash_report_url' not in exemplar:
+                exemplar['crash_report_url'] = blobs.put(exemplar.get('crash_report'))
+                exemplar['stacktrace_render_url'] = blobs.put(exemplar.get('stacktrace_render'))
+            for event in _events(node):
+                blobs.put(event.get('dump_variants'), event['variants_digest'])
+
+        # With --two-phase, only events whose dump differs from their node's
+        # exemplar have it rendered. The others share the exemplar's digest.
+        # The exemplar of an intermediate node lives further down the tree,
+        # so this needs a second pass.
+        for node, _ in root.nodes():
+            for event in _events(node):
+                event['dump_variants_url'] = blobs.get_url(event['variants_digest'])
+                for key in BLOB_FIELDS:
+                    event.pop(key, None)
+
+    def _write_tree_index(self, root: GroupNode):
+        """ Write all nodes of the project in depth-first order
+
+        A node's ID is its position in the list. Everything else a page needs
+        to display its subtree (full label path, URLs, ...) is derived from
+        the parent IDs on the client, see static/tree-index.js.
+        """
+        ids = {}
+        rows = []
+        for node, ancestors in root.nodes():
+            node.index_id = ids[id(node)] = len(rows)
+            rows.append([
+                ids[id(ancestors[-1])] if ancestors else -1,
+                node.name,
+                node.label,
+                _node_title(node),
+                _node_subtitle(node),
+                _get_field(node, 'culprit'),
+                _get_field(node, 'stacktrace_preview'),
+                _get_field(node, 'dump_variants_url'),
+                node.item_count,
+                node.total_item_count,
+            ])
+
+        output_path = self._root_dir / _tree_index_url(root)
+        os.makedirs(output_path.parent, exist_ok=True)
+        with open(output_path, 'w') as f:
+            json.dump({'fields': TREE_INDEX_FIELDS, 'nodes': rows}, f, separators=(',', ':'))
+
+
+#: Item fields moved to the blob store
+BLOB_FIELDS = ('crash_report', 'stacktrace_render', 'dump_variants')
+
+#: Keys of all subtrees of a project, by path, see ProjectReport
+KEYS_FILENAME = "fingerprints.json"
+
+#: What node pages show about the exemplar and the events of a node
+EXEMPLAR_PAGE_FIELDS = ('json_url', 'crash_report_url', 'stacktrace_render_url',
+                        'dump_variants_url')
+EVENT_PAGE_FIELDS = ('event_id', 'json_url', 'title', 'subtitle', 'dump_variants_url')
+
+#: Columns of a node in the tree index
+TREE_INDEX_FIELDS = [
+    'parent_id', 'name', 'label', 'title', 'subtitle', 'culprit',
+    'stacktrace_preview', 'dump_variants_url', 'item_count', 'total_item_count',
+]
+
+
+def _tree_index_url(project: GroupNode) -> str:
+    """ Relative to report dir """
+    return f"{project.name}/tree-index.json"
+
+
+def _shards(root: GroupNode, num_shards: int) -> List[List[GroupNode]]:
+    """ Distribute the root's subtrees over shards of similar size
+
+    Deterministic, so the same tree always results in the same shards.
+    """
+    shards: List[List[GroupNode]] = [[] for _ in range(num_shards)]
+    sizes = [0] * num_shards
+    children = sorted(root.children.values(), key=lambda c: (-c.total_item_count, c.name))
+    for child in children:
+        smallest = sizes.index(min(sizes))
+        shards[smallest].append(child)
+        sizes[smallest] += child.total_item_count + 1
+
+    return [shard for shard in shards if shard]
+
+
+def _keys_by_child(keys: Dict[str, str]) -> Dict[str, Dict[str, str]]:
+    """ Group keys by the child of the root they belong to
+
+    Paths start with the name of the project, so the child is the second part.
+    """
+    keys_by_child: Dict[str, Dict[str, str]] = {}
+    for path, key in keys.items():
+        parts = path.split("/", 2)
+        if len(parts) > 1:
+            keys_by_child.setdefault(parts[1], {})[path] = key
+
+    return keys_by_child
+
+
+def _events(node: GroupNode):
+    """ Items of node, and its exemplar, which can be left out of a sample """
+    if node.exemplar is not None:
+        yield node.exemplar
+    yield from node.items
+
+
+def _merge(dicts):
+    merged = {}
+    for d in dicts:
+        merged.update(d)
+
+    return merged
 
-        return "/".join(path)
-
-    def _write_event_data(self, node, ancestors, update_fn):
-        # Store variant dump on disk, but only if it's different from the
-        # exemplar's dump
-        exemplar_variants = (node.exemplar or {}).get('dump_variants')
-        event_data_target_dir = self._output_path(node, ancestors) / "event_data"
-        os.makedirs(event_data_target_dir, exist_ok=False)
-        for event in node.items:
-            dump_variants = event.get('dump_variants')
-            if event == node.exemplar or dump_variants != exemplar_variants:
-                filename = f"{event['event_id']}-dump-variants.txt"
-                event['dump_variants_url'] = (
-                    f"{self._rel_url(node, ancestors)}/event_data/{filename}"
-                )
-                with open(event_data_target_dir / filename, 'w') as f:
-                    f.write(f"{dump_variants}")
-            else:
-                # Refer to same variant as exemplar
-                # NOTE: assumes that exemplar.dump_variants_url is set earlier
-                event['dump_variants_url'] = node.exemplar['dump_variants_url']
-            update_fn(1)
-
-
-def _get_descendants(node, ancestors):
-    child_ancestors = ancestors + [node]
-    children = [
-        (
-            child,
-            _descendant_url(child, child_ancestors[1:]),
-            _get_descendants(child, child_ancestors),
-        )
-        for child in node.children.values()
-    ]
 
-    children.sort(key= lambda t: _node_title(t[0]))
+def _render_shard(task):
+    """ Render a list of subtrees, possibly in a worker process """
+    report, root_stub, subtrees, previous = task
+    item_count = 0
+    keys = {}
+    for subtree in subtrees:
+        keys.update(report.render_subtree(subtree, [root_stub], previous))
+        item_count += subtree.total_item_count
 
-    return children
+    return item_count, keys, STATS.pop()
 
 
-def _render_to_file(template_name: str, output_path: Path, context: dict):
+def _render_to_file(template_name: str, output_path: Path, context: dict,
+                    rows: Optional[Iterable] = None):
+    """ Render a template straight into output_path
 
-    html = render_to_string(template_name, context)
+    If rows are given, ROWS_MARKER in the page is replaced by ROWS_TEMPLATE,
+    which is rendered for ROWS_PER_CHUNK rows at a time and written right
+    away, so long event lists are never held in memory as a whole.
+    """
+    context = Context(context)
 
     os.makedirs(output_path.parent, exist_ok=True)
     with open(output_path, 'w') as f:
-        f.write(html)
+        page = _render(template_name, context)
+        if rows is None:
+            _write(f, page)
+            return
+
+        head, _, tail = page.partition(ROWS_MARKER)
+        _write(f, head)
+        rows = iter(rows)
+        while True:
+            chunk = list(islice(rows, ROWS_PER_CHUNK))
+            if not chunk:
+                break
+            with context.push(rows=chunk):
+                _write(f, _render(ROWS_TEMPLATE, context))
+        _write(f, tail)
+
 
+@lru_cache(maxsize=None)
+def _template(template_name: str) -> Template:
+    """ Load and compile each template only once per process """
+    return get_template(template_name).template
 
-def _descendant_url(node, ancestors):
-    return "/".join(a.name for a in ancestors + [node]) + "/index.html"
+
+def _render(template_name: str, context: Context) -> str:
+    with STATS.timer("render template"):
+        return _template(template_name).render(context)
+
+
+def _write(f, html: str):
+    with STATS.timer("write HTML"):
+        f.write(html)
+    STATS.count("HTML bytes", len(html))
 
 
 def _is_project(node):
@@ -174,68 +466,32 @@ def _breadcrumb(node):
     return _node_title(node)
 
 
-def _node_hash(node):
-    return None if _is_project(node) else node.name
-
-
-def _get_field(node, name):
-    return node.exemplar and node.exemplar.get(name)
-
-
-def _node_to_d3(node: GroupNode, ancestors=None) -> dict:
-    """ Convert node to d3 format for easy chart rendering """
-
-    if ancestors is None:
-        ancestors = []
-
-    children = [
-        _node_to_d3(child, ancestors + [node])
-        for child in node.children.values()
-    ]
-    children.sort(key=lambda d: d['name'])
+def _node_path(node, ancestors) -> str:
+    """ Relative to report dir """
+    return "/".join([ancestor.name for ancestor in ancestors] + [node.name])
 
-    return {
-        "name": node.label or _node_title(node),
-        "href": _descendant_url(node, ancestors[1:]) if ancestors else None,
-        "item_count": node.item_count,
-        "children": children,
-    }
 
+def _node_digest(node) -> bytes:
+    """ Everything the page of a node shows about the node itself
 
-def set_labels(node, ancestors = None):
-    """ Attach full label path to node """
-    if ancestors is None:
-        ancestors = []
+    With multiple workers, events arrive in a different order every time, so
+    the order of events does not count.
+    """
+    exemplar = node.exemplar or {}
 
-    node.depth = len(ancestors)
+    return json.dumps([
+        _node_title(node),
+        _node_subtitle(node),
+        node.item_count,
+        [exemplar.get(field) for field in EXEMPLAR_PAGE_FIELDS],
+        sorted([item.get(field) or "" for field in EVENT_PAGE_FIELDS] for item in node.items),
+    ]).encode()
 
-    if node.children:
-        for i, child in enumerate(node.children.values()):
-            labels = set_labels(child, ancestors + [node])
-            if i == 0:
-                node.labels = labels
-    else:
-        # Leaf node:
-        node.labels = [ancestor.label for ancestor in ancestors] + [node.label]
 
-    node.has_labels = node.labels and any(node.labels)
-    return node.labels
-
-
-class UpdatingIterator:
-
-    """ Used to connect progress bar with django template """
+def _node_hash(node):
+    return None if _is_project(node) else node.name
 
-    def __init__(self, items, update_fn):
-        self._items = items
-        self._update_fn = update_fn
 
-    def __iter__(self):
-        update_fn = self._update_fn
-        for item in self._items:
-            update_fn(1)
-            yield item
+def _get_field(node, name):
+    return node.exemplar and node.exemplar.get(name)
 
-    def __len__(self):
-        """ Needed by django template """
-        return len(self._items)
@@ -0,0 +1,46 @@
+// Variant dumps, crash reports etc. are packed into bundles.
+// Written by BlobStore, see grouping_tests/blobs.py.
+
+/// Offsets and lengths of blobs by bundle URL, so every index is loaded only once
+const blobIndexes = {};
+
+/// Contents of bundles served without range support, by bundle URL
+const blobBundles = {};
+
+function fetchOK(url, options) {
+    return fetch(url, options).then(response => {
+        if (!response.ok) throw new Error(response.statusText);
+        return response;
+    });
+}
+
+function decodeBlob(buffer, offset, length) {
+    return new TextDecoder().decode(new Uint8Array(buffer, offset, length));
+}
+
+/// Load a blob from a URL like "../blobs/3f.bundle#3f2a..."
+function loadBlob(url, callback) {
+    const [bundleURL, digest] = url.split('#');
+
+    if (!(bundleURL in blobIndexes)) {
+        const indexURL = bundleURL.replace(/\.bundle$/, '.json');
+        blobIndexes[bundleURL] = fetchOK(indexURL).then(response => response.json());
+    }
+
+    blobIndexes[bundleURL].then(index => {
+        const [offset, length] = index[digest];
+        if (bundleURL in blobBundles) {
+            return blobBundles[bundleURL].then(buffer => decodeBlob(buffer, offset, length));
+        }
+
+        const range = `bytes=${offset}-${offset + length - 1}`;
+        return fetchOK(bundleURL, {headers: {Range: range}}).then(response => {
+            if (response.status === 206) {
+                return response.arrayBuffer().then(buffer => decodeBlob(buffer, 0, length));
+            }
+            // The server ignored the range and sent the whole bundle, so keep it
+            blobBundles[bundleURL] = response.arrayBuffer();
+            return blobBundles[bundleURL].then(buffer => decodeBlob(buffer, offset, length));
+        });
+    }).then(callback);
+}
@@ -1,5 +1,5 @@
 
-document.addEventListener('DOMContentLoaded', () => {
+document.addEventListener('issues-ready', () => {
 
     document.querySelectorAll('.compare-events').forEach(a => {
         a.addEventListener('click', (event) => {
@@ -120,22 +120,8 @@ function compareEvents() {
         document.getElementById("compare-modal-body").innerHTML = diffHtml;
     }
 
-    load(leftURL, data => { left = data; onSuccess(); });
-    load(rightURL, data => { right = data; onSuccess(); });
-}
-
-function load(url, callback) {
-    const httpRequest = new XMLHttpRequest();
-
-    httpRequest.onreadystatechange = function () {
-        if (httpRequest.readyState === XMLHttpRequest.DONE) {
-            if (httpRequest.status === 200) {
-                callback(httpRequest.responseText);
-            }
-        }
-    };
-    httpRequest.open('GET', url);
-    httpRequest.send();
+    loadBlob(leftURL, data => { left = data; onSuccess(); });
+    loadBlob(rightURL, data => { right = data; onSuccess(); });
 }
 
 function normalizeURL(href) {
@@ -1,4 +1,9 @@
-document.addEventListener('DOMContentLoaded', () => {
+// Node pages are shared between reports (see ProjectReport), so they do not
+// contain the name of the report. It is the name of the report's directory.
+document.getElementById('report-name').innerText = new URL(reportHome, location.href)
+    .pathname.split('/').filter(part => part).pop();
+
+document.addEventListener('issues-ready', () => {
 
     const collapseAll = document.querySelector('#collapse-all');
     if(collapseAll) collapseAll.addEventListener('click', (event) => {
@@ -29,6 +34,29 @@ document.addEventListener('DOMContentLoaded', () => {
         });
     });
 
+    // Crash reports, variant dumps etc. are shared blobs, load them on demand
+    document.querySelectorAll('pre[data-url]').forEach(pre => {
+        const modal = pre.closest('.modal');
+        modal.addEventListener('show.bs.modal', () => {
+            if (pre.dataset.loaded) return;
+            pre.dataset.loaded = 'true';
+            pre.innerText = 'Loading...';
+            loadBlob(pre.dataset.url, text => { pre.innerText = text; });
+        });
+    });
+
+    document.querySelectorAll('.view-blob').forEach(a => {
+        a.addEventListener('click', (event) => {
+            event.preventDefault();
+            const pre = document.getElementById('blob-modal-data');
+            pre.innerText = 'Loading...';
+            loadBlob(a.href, text => { pre.innerText = text; });
+            const modalEl = document.getElementById('blob-modal');
+            const modal = bootstrap.Modal.getInstance(modalEl) || new bootstrap.Modal(modalEl);
+            modal.show();
+        });
+    });
+
     document.querySelectorAll('.copy-to-clipboard').forEach(button => {
         button.addEventListener('click', (event) => {
             const sourceEl = document.getElementById(button.dataset.source);
@@ -41,7 +69,8 @@ document.addEventListener('DOMContentLoaded', () => {
     });
 
     const toggleCardinality = document.getElementById('toggle-cardinality');
-    if(toggleCardinality) toggleCardinality.addEventListener('change', event => {
+    // treeChartData is not set if the issue tree failed to load, see tree-index.js
+    if(toggleCardinality && typeof treeChartData !== 'undefined') toggleCardinality.addEventListener('change', event => {
         if(event.target.checked) {
             renderTreeChart(treeChartData, true);
         } else {
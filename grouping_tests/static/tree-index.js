@@ -0,0 +1,212 @@
+// Issue tree of a project, shared by all of its node pages.
+// Written by ProjectReport._write_tree_index.
+
+document.addEventListener('DOMContentLoaded', () => {
+    const issues = document.getElementById('issues');
+    if (issues === null) {
+        // Node without children, nothing to load
+        document.dispatchEvent(new Event('issues-ready'));
+        return;
+    }
+
+    issues.innerText = 'Loading...';
+    loadTreeIndex(treeIndexURL, nodes => {
+        const node = findNode(nodes, treeNodePath);
+
+        // Deliberately global, see group-node.js
+        treeChartData = toD3(node, node);
+        renderTreeChart(treeChartData, true);
+
+        issues.innerHTML = '';
+        sortedChildren(node).forEach(child => {
+            issues.appendChild(groupBox(child, node));
+        });
+    }, error => {
+        issues.innerText = `Failed to load issues: ${error.message}`;
+    });
+});
+
+/// Calls either callback or errback, then dispatches 'issues-ready' either
+/// way, so the rest of the page works without the issue tree
+function loadTreeIndex(url, callback, errback) {
+    const httpRequest = new XMLHttpRequest();
+
+    httpRequest.onreadystatechange = function () {
+        if (httpRequest.readyState === XMLHttpRequest.DONE) {
+            try {
+                if (httpRequest.status !== 200) {
+                    throw new Error(`${httpRequest.status} ${httpRequest.statusText}`);
+                }
+                callback(parseTreeIndex(JSON.parse(httpRequest.responseText)));
+            } catch (error) {
+                console.error(error);
+                errback(error);
+            } finally {
+                document.dispatchEvent(new Event('issues-ready'));
+            }
+        }
+    };
+    httpRequest.open('GET', url);
+    httpRequest.send();
+}
+
+/// Turn rows of the index into linked node objects, indexed by node ID
+function parseTreeIndex(index) {
+    const nodes = index.nodes.map(row => {
+        const node = {children: []};
+        index.fields.forEach((field, i) => { node[field] = row[i]; });
+        return node;
+    });
+
+    // Parents precede their children. Children appear in insertion order,
+    // like GroupNode.children
+    nodes.forEach(node => {
+        node.parent = node.parent_id >= 0 ? nodes[node.parent_id] : null;
+        node.depth = node.parent ? node.parent.depth + 1 : 0;
+        if (node.parent) node.parent.children.push(node);
+    });
+
+    return nodes;
+}
+
+/// Look up a node by the names on its path below the project, e.g. "a/b"
+function findNode(nodes, path) {
+    var node = nodes[0];
+    path.split('/').filter(name => name).forEach(name => {
+        node = node.children.find(child => child.name === name);
+    });
+    return node;
+}
+
+function sortedChildren(node) {
+    return node.children.slice().sort((a, b) => compare(a.title, b.title));
+}
+
+function compare(a, b) {
+    return a < b ? -1 : (a > b ? 1 : 0);
+}
+
+/// URL of node relative to the page of one of its ancestors
+function relativeURL(node, pageNode) {
+    const names = [];
+    for (var n = node; n !== pageNode; n = n.parent) names.unshift(n.name);
+    return names.join('/') + '/index.html';
+}
+
+/// Labels from the project root down to the first leaf below node
+function labels(node) {
+    const rv = [];
+    for (var n = node; n; n = n.parent) rv.unshift(n.label);
+    for (var n = node.children[0]; n; n = n.children[0]) rv.push(n.label);
+    return rv;
+}
+
+/// Convert node to d3 format for easy chart rendering
+function toD3(node, pageNode) {
+    const children = node.children.map(child => toD3(child, pageNode));
+    children.sort((a, b) => compare(a.name, b.name));
+
+    return {
+        name: node.label || node.title,
+        href: node === pageNode ? null : relativeURL(node, pageNode),
+        item_count: node.item_count,
+        children: children,
+    };
+}
+
+/// Create an element. Strings among children become text nodes.
+function element(tag, attributes, children) {
+    const el = document.createElement(tag);
+    Object.entries(attributes || {}).forEach(([key, value]) => el.setAttribute(key, value));
+    (children || []).forEach(child => el.append(child));
+    return el;
+}
+
+/// Card for a node and its collapsible descendants
+function groupBox(node, pageNode) {
+    const hasChildren = node.children.length > 0;
+
+    const titleLine = [];
+    if (hasChildren) {
+        titleLine.push(element('span', {
+            'class': 'collapser',
+            'id': 'collapser-' + node.name,
+            'data-bs-toggle': 'collapse',
+            'data-bs-target': '#children-of-' + node.name,
+            'aria-expanded': 'true',
+            'aria-controls': 'children-of-' + node.name,
+            'style': 'margin-left: -.5rem;',
+        }, [
+            element('span', {'class': 'text-muted'}, [element('i', {'class': 'bi-chevron-right'})]),
+        ]));
+    }
+    titleLine.push(
+        element('a', {'class': 'title', 'href': relativeURL(node, pageNode)}, [node.title || '']),
+        ' ',
+        element('small', {'class': 'culprit text-muted'}, [node.label ? '' : (node.culprit || '')]),
+    );
+
+    const header = element('div', {'class': 'card-header'}, [
+        element('div', {'class': 'float-start'}, titleLine),
+        element('div', {'class': 'float-end text-muted'}, [
+            element('i', {
+                'id': 'favorite-' + node.name,
+                'class': 'favorite bi-star',
+                'data-node': node.name,
+            }),
+            ' ',
+            element('span', {'title': 'events in this node'}, [
+                element('i', {'class': 'bi-paperclip'}), ' ' + node.item_count,
+            ]),
+            ' / ',
+            element('span', {'title': 'events in subtree'}, [
+                element('i', {'class': 'bi-diagram-2-fill'}), ' ' + node.total_item_count,
+            ]),
+            ' ',
+            // No link if the variants could not be dumped
+            element('span', {'class': 'event-tools'}, node.dump_variants_url ? [
+                element('a', {
+                    'href': reportHome + node.dump_variants_url,
+                    'class': 'compare-events',
+                    'title': 'Compare',
+                }, [element('i')]),
+            ] : []),
+        ]),
+    ]);
+
+    const card = element('div', {'class': 'card mb-1'}, [header]);
+
+    const nodeLabels = labels(node);
+    const hasLabels = nodeLabels.some(label => label);
+    if (node.subtitle || hasLabels || node.stacktrace_preview) {
+        const body = element('div', {'class': 'card-body'}, [
+            element('p', {'class': 'subtitle'}, [node.subtitle || '']),
+        ]);
+        if (hasLabels) {
+            body.append(element('div', {'class': 'border bg-light'}, nodeLabels.map((label, i) => {
+                if (!label) return '';
+                const className = i === node.depth ? 'preview-line fw-bold' : 'preview-line';
+                return element('pre', {'class': className}, [element('small', {}, [label])]);
+            })));
+        } else if (node.stacktrace_preview) {
+            body.append(element('pre', {'class': 'border bg-light'}, [
+                element('small', {}, [node.stacktrace_preview]),
+            ]));
+        }
+        card.append(body);
+    }
+
+    const children = element('div', {'class': 'children'});
+    if (hasChildren) {
+        children.append(element('div', {
+            'id': 'children-of-' + node.name,
+            'class': 'collapse ms-5 mb-3',
+            'data-handle': 'collapser-' + node.name,
+        }, sortedChildren(node).map(child => groupBox(child, pageNode))));
+    }
+
+    return element('div', {'class': 'group-box'}, [
+        element('div', {'class': 'clearfix parent'}, [card]),
+        children,
+    ]);
+}
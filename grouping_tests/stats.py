@@ -0,0 +1,66 @@
+from collections import defaultdict
+from contextlib import contextmanager
+from threading import Lock
+from typing import Dict
+import time
+
+
+class Stats:
+
+    """ Timers and counters of one process
+
+    Worker processes send their stats along with their results (see pop),
+    and the main process merges them into its own, so the totals cover all
+    processes. Times are summed up over processes, so they can exceed the
+    wall time of a run.
+    """
+
+    def __init__(self):
+        self._seconds: Dict[str, float] = defaultdict(float)
+        self._calls: Dict[str, int] = defaultdict(int)
+        self._counters: Dict[str, int] = defaultdict(int)
+        self._lock = Lock()
+
+    @contextmanager
+    def timer(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self._seconds[name] += elapsed
+                self._calls[name] += 1
+
+    def count(self, name: str, value: int = 1):
+        with self._lock:
+            self._counters[name] += value
+
+    def pop(self) -> dict:
+        """ Return everything recorded since the last call and start over """
+        with self._lock:
+            snapshot = self.to_dict()
+            self._seconds.clear()
+            self._calls.clear()
+            self._counters.clear()
+
+        return snapshot
+
+    def merge(self, snapshot: dict):
+        """ Add the result of another process' pop() """
+        with self._lock:
+            for name, (calls, seconds) in snapshot['timers'].items():
+                self._calls[name] += calls
+                self._seconds[name] += seconds
+            for name, value in snapshot['counters'].items():
+                self._counters[name] += value
+
+    def to_dict(self) -> dict:
+        return {
+            'timers': {name: (self._calls[name], self._seconds[name]) for name in self._seconds},
+            'counters': dict(self._counters),
+        }
+
+
+#: Stats of the current process
+STATS = Stats()
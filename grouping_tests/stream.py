@@ -0,0 +1,27 @@
+from itertools import chain
+from typing import IO, Iterator, Tuple
+import json
+
+
+def read_documents(input_stream: IO[str]) -> Iterator[str]:
+    """ Iterate raw JSON documents of a multi doc stream written by dump_events.py """
+    for line in input_stream:
+        line = line.strip()
+        if line == "---" or not line:
+            continue
+
+        yield line
+
+
+def split_header(documents: Iterator[str]) -> Tuple[dict, Iterator[str]]:
+    """ Separate the optional header (e.g. ``{"max_events": 1000}``) from the events """
+    first = next(documents, None)
+    if first is None:
+        return {}, iter(())
+
+    header = json.loads(first)
+    if isinstance(header, dict) and "event_id" not in header:
+        return header, documents
+
+    # No header, first document is an event
+    return {}, chain([first], documents)
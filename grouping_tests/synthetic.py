@@ -0,0 +1,135 @@
+""" Synthetic events, to measure performance without a corpus of real events """
+from functools import lru_cache
+from typing import Any, Dict, Iterator, List, Sequence, Tuple
+import hashlib
+import random
+
+from grouping_tests.groups.base import HashData
+
+
+PLATFORMS = ('python', 'javascript', 'java', 'native', 'cocoa')
+
+_EXTENSIONS = {
+    'python': "py", 'javascript': "js", 'java': "java", 'native': "cpp", 'cocoa': "swift",
+}
+
+#: Start of the synthetic timeline, like a Snuba timestamp
+_BASE_TIMESTAMP = 1614556800
+
+
+class EventGenerator:
+
+    """ Deterministic event payloads in the format of sentry's nodestore
+
+    Events fall into ``num_groups`` groups of very different sizes, like real
+    events do. Going up the stack from the crashing frame, every frame of a
+    group is one of ``fan_out`` alternatives, so groups share shorter or longer
+    stack prefixes, and hierarchical grouping results in a tree with that fan-out.
+    """
+
+    def __init__(self, num_groups: int = 1000, platforms: Sequence[str] = PLATFORMS,
+                 num_frames: int = 20, num_threads: int = 1, chain_depth: int = 1,
+                 fan_out: int = 4, seed: int = 0):
+        self._num_groups = num_groups
+        self._platforms = platforms
+        self._num_frames = num_frames
+        self._num_threads = num_threads  # Including the crashing one
+        self._chain_depth = chain_depth  # Exceptions per event
+        self._fan_out = fan_out
+        self._seed = seed
+
+    def events(self, project_id: str, num_events: int) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        """ Yield every event along with its group """
+        rng = random.Random(f"{self._seed}:{project_id}")
+        for index in range(num_events):
+            group = self.pick_group(rng)
+            yield group, self._event(rng, project_id, index, group)
+
+    def pick_group(self, rng: random.Random) -> int:
+        """ Few large groups, many small ones """
+        return (int(rng.paretovariate(1.0)) - 1) % self._num_groups
+
+    def group_hashes(self, group: int) -> Tuple[List[HashData], List[HashData]]:
+        """ Flat and hierarchical hashes like grouping an event of group would result in
+
+        Not what sentry computes, but of the same shape: one flat hash per
+        group, which one in ten groups shares with its neighbor, so some flat
+        groups are merged, and one hierarchical hash per level of the tree.
+        """
+        return _group_hashes(group, self._fan_out, self._num_frames, self._num_groups)
+
+    def _event(self, rng: random.Random, project_id: str, index: int,
+               group: int) -> Dict[str, Any]:
+        platform = self._platforms[group % len(self._platforms)]
+        event = {
+            'event_id': f"{rng.getrandbits(128):032x}",
+            'project': int(project_id),
+            'platform': platform,
+            'timestamp': _BASE_TIMESTAMP + index,
+            'level': "error",
+            'exception': {'values': [
+                {
+                    'type': f"Error{(group + depth) % 50}",
+                    'value': f"Synthetic error {group}",
+                    'mechanism': {'type': "generic", 'handled': depth > 0},
+                    'stacktrace': {'frames': self._frames(platform, group + depth)},
+                }
+                # Sentry orders chained exceptions from the cause to the outermost
+                for depth in reversed(range(self._chain_depth))
+            ]},
+        }
+
+        if self._num_threads > 1:
+            event['threads'] = {'values': [{'id': 0, 'crashed': True, 'current': True}] + [
+                {
+                    'id': thread_id, 'crashed': False, 'current': False,
+                    'stacktrace': {'frames': self._frames(platform, rng.randrange(1000))},
+                }
+                for thread_id in range(1, self._num_threads)
+            ]}
+
+        return event
+
+    def _frames(self, platform: str, group: int) -> List[Dict[str, Any]]:
+        extension = _EXTENSIONS.get(platform, "txt")
+        frames = []
+        # Frames are ordered from the outermost to the crashing one
+        for level in reversed(range(self._num_frames)):
+            choice = _choice(group, level, self._fan_out)
+            frames.append({
+                'function': f"func_{level}_{choice}",
+                'module': f"app.module_{level % 7}",
+                'filename': f"app/module_{level % 7}.{extension}",
+                'lineno': 10 * level + choice,
+                'in_app': level < self._num_frames // 2,
+            })
+
+        return frames
+
+
+def _choice(group: int, level: int, fan_out: int) -> int:
+    """ Which of the fan_out alternatives the frame ``level`` frames above the crash is """
+    return (group // fan_out ** level) % fan_out
+
+
+@lru_cache(maxsize=None)
+def _group_hashes(group: int, fan_out: int, num_levels: int,
+                  num_groups: int) -> Tuple[List[HashData], List[HashData]]:
+    flat_group = group - 1 if group % 10 == 1 else group
+    flat = [HashData(_digest(f"flat:{flat_group}"), None)]
+    if flat_group != group:
+        flat.append(HashData(_digest(f"flat:{group}"), None))
+
+    path = ""
+    hierarchical = []
+    for level in range(num_levels):
+        if fan_out ** level >= num_groups:
+            break  # All groups are distinct already
+        path += f"/{_choice(group, level, fan_out)}"
+        hierarchical.append(HashData(_digest(f"tree:{path}"), f"func_{level}"))
+
+    return flat, hierarchical
+
+
+def _digest(value: str) -> str:
+    return hashlib.md5(value.encode()).hexdigest()
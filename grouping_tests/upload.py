@@ -0,0 +1,158 @@
+from abc import ABC, abstractmethod
+from queue import Queue
+from threading import Lock, Thread
+from typing import Optional
+import logging
+import random
+import time
+
+
+LOG = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class Sender(ABC):
+
+    """ Sends one serialized envelope. Must be safe to use from multiple threads """
+
+    @abstractmethod
+    def send(self, body: bytes) -> int:
+        """ Return the HTTP status. Network errors are raised """
+
+    @abstractmethod
+    def retry_after(self) -> float:
+        """ Seconds until the server accepts events again, 0 if not rate limited """
+
+
+class TokenBucket:
+
+    """ Limit the rate of events, allowing for short bursts
+
+    By default, bursts are limited to a tenth of a second's worth of events,
+    so no one-second window sees much more than ``rate`` events.
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self._rate = rate  # tokens per second
+        self._capacity = burst or max(rate / 10, 1)
+        self._tokens = self._capacity
+        self._last_refill = time.monotonic()
+        self._lock = Lock()
+
+    def acquire(self):
+        """ Block until a token is available """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self._capacity, self._tokens + (now - self._last_refill) * self._rate)
+                self._last_refill = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self._rate
+
+            time.sleep(wait)
+
+
+class UploadStats:
+
+    def __init__(self):
+        self.num_sent = 0
+        self.num_retried = 0  # Retries, not envelopes: an envelope can be retried several times
+        self.num_dropped = 0
+        self._lock = Lock()
+
+    def count(self, name: str):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def __str__(self):
+        return (
+            f"{self.num_sent} envelopes sent, {self.num_retried} retries, "
+            f"{self.num_dropped} dropped"
+        )
+
+
+class Uploader:
+
+    """ Send serialized envelopes from a pool of threads
+
+    All threads share one sender, so they share its connection pool and its
+    view of rate limits: while the server asks to back off, no thread sends.
+    Failed sends are retried with exponential backoff. Envelopes are only
+    dropped after ``max_retries`` or if the server rejects them for good
+    (e.g. 400), and every one of them is counted.
+    """
+
+    def __init__(self, sender: Sender, num_threads: int,
+                 events_per_second: Optional[float] = None,
+                 max_retries: int = 5, backoff: float = 1.0, max_backoff: float = 60.0):
+        self._sender = sender
+        self._bucket = TokenBucket(events_per_second) if events_per_second else None
+        self._max_retries = max_retries
+        self._backoff = backoff  # seconds before first retry
+        self._max_backoff = max_backoff
+
+        self.stats = UploadStats()
+
+        # Large enough so that workers do not wait
+        self._queue: Queue = Queue(2 * num_threads + 2)
+        self._threads = [Thread(target=self._worker_loop, daemon=True) for _ in range(num_threads)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, body: bytes):
+        """ Blocks if all threads are busy """
+        self._queue.put(body)
+
+    def close(self) -> UploadStats:
+        """ Send all submitted envelopes, then stop """
+        for _ in self._threads:
+            self._queue.put(_STOP)
+        for thread in self._threads:
+            thread.join()
+
+        return self.stats
+
+    def _worker_loop(self):
+        while True:
+            body = self._queue.get()
+            if body is _STOP:
+                break
+            self._send(body)
+
+    def _send(self, body: bytes):
+        for attempt in range(self._max_retries + 1):
+            if attempt:
+                self.stats.count('num_retried')
+
+            # Honour rate limits announced by the server to any of the threads
+            retry_after = self._sender.retry_after()
+            if retry_after > 0:
+                time.sleep(retry_after)
+
+            if self._bucket is not None:
+                self._bucket.acquire()
+
+            try:
+                status = self._sender.send(body)
+            except Exception as e:  # pylint: disable=broad-except
+                LOG.warning("Failed to send envelope: %s", e)
+            else:
+                if 200 <= status < 300:
+                    self.stats.count('num_sent')
+                    return
+                if status != 429 and status < 500:
+                    LOG.warning("Envelope rejected with status %s", status)
+                    break
+                if status == 429 and self._sender.retry_after() > 0:
+                    # Wait for retry_after() at the start of the next attempt
+                    continue
+
+            # Exponential backoff with jitter, so threads do not retry in lockstep
+            delay = min(self._max_backoff, self._backoff * 2 ** attempt)
+            time.sleep(delay * random.uniform(0.5, 1.0))
+
+        self.stats.count('num_dropped')
@@ -0,0 +1,84 @@
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, Iterable, Iterator, List, Set
+import logging
+import time
+
+
+LOG = logging.getLogger(__name__)
+
+
+#: Fetch up to ``limit`` IDs greater than ``after_id`` in ascending order
+FetchIds = Callable[[int, int], List[int]]
+
+#: Delete the given IDs, return the number of IDs actually deleted
+DeleteIds = Callable[[List[int]], int]
+
+
+class WipeStats:
+
+    def __init__(self):
+        self.num_deleted = 0
+        self.num_failed_chunks = 0
+        self.start_time = time.time()
+
+    @property
+    def elapsed(self) -> float:
+        return time.time() - self.start_time
+
+    @property
+    def rate(self) -> float:
+        return self.num_deleted / max(self.elapsed, 1e-9)
+
+    def __str__(self):
+        return (
+            f"{self.num_deleted} groups deleted, {self.num_failed_chunks} chunks failed, "
+            f"{self.elapsed:.1f}s ({self.rate:.1f} groups/s)"
+        )
+
+
+def iter_id_chunks(fetch_ids: FetchIds, chunk_size: int) -> Iterator[List[int]]:
+    """ Stream IDs in chunks, each one continuing after the last ID of the previous one """
+    after_id = 0
+    while True:
+        ids = fetch_ids(after_id, chunk_size)
+        if not ids:
+            return
+        yield ids
+        after_id = ids[-1]
+
+
+def delete_in_chunks(chunks: Iterable[List[int]], delete_ids: DeleteIds, num_workers: int,
+                     on_progress: Callable[[int], None] = lambda _: None) -> WipeStats:
+    """ Delete chunks of IDs on a pool of threads
+
+    At most ``2 * num_workers`` chunks are read ahead. A failed chunk is
+    logged and skipped. Whatever was not deleted is picked up again by the
+    next run, so an interrupted wipe can simply be restarted.
+    """
+    stats = WipeStats()
+    max_pending = 2 * num_workers
+
+    with ThreadPoolExecutor(num_workers) as executor:
+        pending: Set[Future] = set()
+
+        def collect(done: Iterable[Future]):
+            for future in done:
+                pending.discard(future)
+                try:
+                    num_deleted = future.result()
+                except Exception as e:  # pylint: disable=broad-except
+                    LOG.error("Failed to delete chunk: %s", e)
+                    stats.num_failed_chunks += 1
+                else:
+                    stats.num_deleted += num_deleted
+                    on_progress(num_deleted)
+
+        for chunk in chunks:
+            pending.add(executor.submit(delete_ids, chunk))
+            if len(pending) >= max_pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+
+        collect(wait(pending).done)
+
+    return stats
@@ -6,13 +6,10 @@ from sentry.runner import configure
 configure()
 
 import click
-from multiprocessing import Manager
 import sys
-import json
-import textwrap
 import time
 from pathlib import Path
-import os
+from typing import Optional
 
 from sentry import nodestore
 from sentry.eventstore.models import Event
@@ -20,14 +17,22 @@ from sentry.eventstore.models import Event
 import sentry_sdk
 sentry_sdk.init("")
 
-
-global_output_dir = None  # Used in fetch_and_store
+from grouping_tests.corpus import CorpusWriter
+from grouping_tests.fetch import (
+    EventWriter, fetch_events, nodestore_fetcher, parse_event_keys)
 
 
 @click.command()
 @click.option("--output-dir", required=True, type=Path)
-@click.option("--num-workers", type=int, help="Defaults to Python multiprocessing default")
-def store_events(output_dir: Path, num_workers: int):
+@click.option("--num-workers", type=int, default=16, show_default=True,
+              help="Number of threads fetching from nodestore")
+@click.option("--batch-size", type=int, default=100, show_default=True,
+              help="Number of events fetched per nodestore request")
+@click.option("--segment-size", type=int,
+              help="If set, append events to compressed segments of at most this many MB "
+                   "per project instead of writing one JSON file per event")
+def store_events(output_dir: Path, num_workers: int, batch_size: int,
+                 segment_size: Optional[int]):
     """ Store event payloads as JSON files
 
     Usage example:
@@ -36,59 +41,39 @@ def store_events(output_dir: Path, num_workers: int):
             | python store_events.py --output-dir ./events
 
     """
-    global global_output_dir  # pylint: disable=global-statement
-    global_output_dir = output_dir
-
     if output_dir.exists():
         print(f"ERROR: Output dir {output_dir} already exists")
         sys.exit(1)
 
     t0 = time.time()
 
-    print("Reading event IDs from stdin...")
-    lines = list(sys.stdin)  # So we have a length for the progress bar
-
     print("Fetching event payloads...")
-    with Manager() as manager:
-        with manager.Pool(num_workers) as pool:  # type: ignore
-            tasks = pool.imap_unordered(fetch_and_store, lines)
-            progress_bar = click.progressbar(tasks, length=len(lines))
-
-            with progress_bar as results:
-                for _ in results:
-                    pass
-
+    fetch_batch = nodestore_fetcher(nodestore, Event.generate_node_id)
+    if segment_size:
+        writer = CorpusWriter(output_dir, segment_size * 1024 * 1024)
+    else:
+        writer = EventWriter(output_dir)
+    progress = Progress()
+    try:
+        stats = fetch_events(
+            parse_event_keys(sys.stdin), fetch_batch, writer, batch_size, num_workers, progress)
+    finally:
+        writer.close()
+    print(f"\n{stats}")
 
     print("Done. Time ellapsed: %s" % (time.time() - t0))
 
 
-def fetch_and_store(line):
-    project_id, event_id = line.strip().split("\t")
-    event_id = event_id.replace("-", "")
-    node_id = Event.generate_node_id(project_id, event_id)
-    node = nodestore.get(node_id)  # pylint: disable=no-member
-
-    if node is None:
-        print(
-            "WARNING: Got None from nodestore for project / event",
-            project_id, event_id, file=sys.stderr)
-    else:
-        store(project_id, event_id, node, global_output_dir)
-
-
-def store(project_id, event_id, node, output_dir: Path):
-    output_path = output_dir / f"project_{project_id}" / event_path(event_id)
-    os.makedirs(output_path.parent, exist_ok=True)
-    with open(output_path, 'w') as output_file:
-        json.dump(node, output_file)
+class Progress:
 
+    """ Number of events is not known up front, so count instead of showing a bar """
 
-def event_path(event_id: str, prefix_length=2, num_levels=2) -> Path:
-    """ Spread out files by chopping up the event ID """
-    id_parts = textwrap.wrap(event_id, prefix_length)
-    target_dir = Path().joinpath(*id_parts[:num_levels])
+    def __init__(self):
+        self._count = 0
 
-    return target_dir / f"event_{event_id}.json"
+    def __call__(self, count: int):
+        self._count += count
+        print(f"\r{self._count} events", end="", file=sys.stderr, flush=True)
 
 
 if __name__ == "__main__":
@@ -1,17 +1,22 @@
 from sentry.runner import configure
 configure()
 
+import gzip
 import json
 import time
 import uuid
 import click
 from datetime import datetime
+from itertools import islice
+from multiprocessing import Pool
 from pathlib import Path
-from queue import Queue
-from multiprocessing import cpu_count
-from threading import Thread
+from threading import Lock
+from typing import List, Optional
 
+import urllib3
 from wipe_project import delete_groups
+from grouping_tests.stream import read_documents, split_header
+from grouping_tests.upload import Sender, Uploader
 from sentry.models import Project, ProjectKey
 from sentry.stacktraces.processing import find_stacktraces_in_data
 from sentry.utils.safe import get_path, set_path
@@ -22,8 +27,6 @@ from sentry_sdk.envelope import Envelope
 
 sentry_sdk.init("")
 
-StopWorking = "stop_working"
-
 
 @click.command()
 @click.option("--file-name", required=True, type=Path, help="File/pipe name to use for reading the events")
@@ -33,13 +36,22 @@ StopWorking = "stop_working"
 @click.option("--org-slug", type=str, help="organization slug, must also use project-slug, alternatively use project-id or dsn")
 @click.option("--network-threads", default=64, help="How many threads to use for sending")
 @click.option("--wipe-project/--leave-project", default=False, type=bool, help="remove all existing messages from the project before import")
-@click.option("--event-sleep", default=0, help="How many milliseconds to sleep between events")
-def upload_events(file_name: Path, dsn: str, project_id: int, project_slug: str, org_slug: str, wipe_project: bool, event_sleep: int, network_threads: int):
+@click.option("--events-per-second", type=float, help="Target upload rate. Rate limits are honoured either way")
+@click.option("--event-sleep", type=int, help="Deprecated, use --events-per-second. Milliseconds per event")
+@click.option("--max-retries", default=5, help="How often to retry an envelope before dropping it")
+@click.option("--num-workers", type=int, help="How many processes to use for preparing events. Defaults to Python multiprocessing default")
+@click.option("--chunksize", default=100, help="How many events to send to a worker process at once")
+def upload_events(file_name: Path, dsn: str, project_id: int, project_slug: str, org_slug: str, wipe_project: bool, events_per_second: float, event_sleep: int, max_retries: int, network_threads: int, num_workers: int, chunksize: int):
     """
     Reads events from a file (or named pipe) containing a multi doc yaml and sends them to a project.
 
     Optionally it wipes the project of all messages before starting to send.
     """
+    if event_sleep:
+        click.echo("--event-sleep is deprecated, use --events-per-second", err=True)
+        if events_per_second is None:
+            events_per_second = 1000.0 / event_sleep
+
     if dsn is None:
         if project_id is not None:
             project = Project.objects.get(id=project_id)
@@ -57,9 +69,7 @@ def upload_events(file_name: Path, dsn: str, project_id: int, project_slug: str,
     with open(file_name, "rt") as input_stream:
         now = time.time()
 
-        events = _parse_lines(input_stream)
-
-        header = next(events)
+        header, documents = split_header(read_documents(input_stream))
 
         num_events = header.get("max_events")
         if num_events is None:
@@ -68,151 +78,206 @@ def upload_events(file_name: Path, dsn: str, project_id: int, project_slug: str,
         else:
             print(f"Uploading {num_events} events....")
 
-        q = Queue(network_threads * 2 + 2)  # large enough so that workers do not wait
-
-        workers = []
-
-        for i in range(network_threads):
-            t = Thread(target=worker_loop, args=(dsn, q))
-            t.start()
-            workers.append(t)
-
-        with click.progressbar(events, length=num_events) as events2:
-            last_sleep = time.time()
-            event_count = 0
-            skip_count = 0
-
-            for event in events2:
-
-                if skip_event(event):
-                    skip_count += 1
-                    continue
-
-                event.pop('project', None)
-                if get_path(event, 'exception', 'values', 0, 'stacktrace', 'frames'):
-                    event.pop('threads', None)
-                elif (
-                    get_path(event, "logentry", "formatted") and
-                    get_path(event, "threads", "values") and
-                    get_path(event, "platform") == "cocoa"
-                ):
-                    # Deal with Cocoa 6 NSError events that are sent as
-                    # stacktrace + logentry
-                    # we assume all of those kinds of events are NSError which
-                    # is not really true, only most of the time
-                    message = event.pop("logentry")['formatted']
-
-                    threads = event.pop("threads")['values']
-                    thread = next((x for x in threads if x.get('current')), threads[0])
-
-                    event['exception'] = {
-                        "values": [
-                            {
-                                "type": message,
-                                "mechanism": {
-                                    "type": "NSError",
-                                    "value": "<converted from sentry-cocoa 6>",
-                                    "meta": {
-                                        "ns_error": {
-                                            # Not 100% correct, domain is a
-                                            # substring of message but it
-                                            # should group about the same as we
-                                            # always group by (domain, code)
-                                            "domain": message,
-                                            "code": 2,
-                                        }
-                                    }
-                                },
-                                "stacktrace": thread.get("stacktrace"),
-                            }
-                        ]
-                    }
-                elif get_path(event, "platform") == "cocoa" and get_path(event, "exception", "values", 0, "mechanism", "meta", "ns_error") and not get_path(event, "exception", "values", 0, "stacktrace") and get_path(event, "threads", "values"):
-                    # Event the Cocoa 6 events are "crappy" because the
-                    # exception contains no stacktrace, instead the thread does
-                    #
-                    # TODO(markus): Relay should've normalized this
-                    threads = event.pop("threads")['values']
-                    thread = next((x for x in threads if x.get('current')), threads[0])
-                    if thread and thread.get("stacktrace"):
-                        event['exception']['values'][0]['stacktrace'] = thread["stacktrace"]
-
-                event.pop('debug_meta', None)
-                event.pop('_ref', None)
-                event.pop('_ref_version', None)
-                event.pop('location', None)
-                event.pop('title', None)
-
-                # make sure the event does not go through minidump processing,
-                # otherwise we get weird errors in the pipeline we have to
-                # ignore
-                exceptions = get_path(event, "exception", "values", filter=True)
-                if exceptions:
-                    mechanism = get_path(exceptions, 0, "mechanism", "type")
-
-                    if mechanism:
-                        set_path(exceptions, 0, "mechanism", "type", value=f"{mechanism}_disabled")
-
-                for stacktrace_info in find_stacktraces_in_data(event):
-                    for frame in get_path(stacktrace_info.stacktrace, "frames", filter=True, default=()) or ():
-                        orig_in_app = get_path(frame, "data", "orig_in_app")
-                        if orig_in_app is not None:
-                            frame["in_app"] = None if orig_in_app == -1 else bool(orig_in_app)
-
-                event_id = event.pop('event_id', None)
-                event['tags'] = {"orig_event_id": event_id}
-                event['event_id'] = event_id = str(uuid.uuid4().hex).replace("-", "")
-
-                envelope = Envelope(
-                    headers={
-                        "event_id": event_id,
-                        "sent_at": format_timestamp(datetime.utcnow())
-                    }
-                )
-
-                envelope.add_event(event)
-
-                q.put(envelope)
-
-                event_count += 1
-
-                if event_sleep and time.time() - last_sleep > 10 and event_count > 100:
-                    time.sleep(event_count * event_sleep / 1000.0)
-                    last_sleep = time.time()
-                    event_count = 0
-
-        # send end of work signals to the workers, put a few more to be sure
-        for i in range(network_threads + 2):
-            q.put(StopWorking)
+        skip_count = 0
+        chunks = iter(lambda: list(islice(documents, chunksize)), [])
+        with Pool(num_workers) as pool:
+            # Start sender threads only after the worker processes are forked
+            uploader = Uploader(EnvelopeSender(dsn, network_threads), network_threads, events_per_second, max_retries)
+
+            with click.progressbar(length=num_events) as progress_bar:
+                # imap keeps the order of the input
+                for envelopes in pool.imap(_transform_chunk, chunks):
+                    for envelope in envelopes:
+                        if envelope is None:
+                            skip_count += 1
+                        else:
+                            uploader.submit(envelope)
+                    progress_bar.update(len(envelopes))
 
         # wait for workers to finish
-        for worker in workers:
-            worker.join()
+        stats = uploader.close()
 
         if skip_count:
             print(f"Skipped {skip_count} event(s).")
 
-        print(f"Done. Elapsed time is {time.time() - now} secs.")
-
-def _parse_lines(input_stream):
-    for line in input_stream:
-        line = line.strip()
-        if line == "---" or not line:
-            continue
+        print(f"{stats}.")
 
-        yield json.loads(line)
+        print(f"Done. Elapsed time is {time.time() - now} secs.")
 
-def worker_loop(dsn, queue):
-    client = sentry_sdk.Client(dsn)
-    while True:
-        msg = queue.get()
-        if msg == StopWorking:
-            break
 
-        client.transport._send_envelope(msg)
+def _transform_chunk(documents: List[str]) -> List[Optional[bytes]]:
+    """ Runs in a worker process. Returns serialized envelopes, None for skipped events """
+    return [_transform(json.loads(document)) for document in documents]
+
+
+def _transform(event: dict) -> Optional[bytes]:
+    """ Rewrite event so it can be uploaded again, and wrap it in an envelope """
+    if skip_event(event):
+        return None
+
+    event.pop('project', None)
+    if get_path(event, 'exception', 'values', 0, 'stacktrace', 'frames'):
+        event.pop('threads', None)
+    elif (
+        get_path(event, "logentry", "formatted") and
+        get_path(event, "threads", "values") and
+        get_path(event, "platform") == "cocoa"
+    ):
+        # Deal with Cocoa 6 NSError events that are sent as
+        # stacktrace + logentry
+        # we assume all of those kinds of events are NSError which
+        # is not really true, only most of the time
+        message = event.pop("logentry")['formatted']
+
+        threads = event.pop("threads")['values']
+        thread = next((x for x in threads if x.get('current')), threads[0])
+
+        event['exception'] = {
+            "values": [
+                {
+                    "type": message,
+                    "mechanism": {
+                        "type": "NSError",
+                        "value": "<converted from sentry-cocoa 6>",
+                        "meta": {
+                            "ns_error": {
+                                # Not 100% correct, domain is a
+                                # substring of message but it
+                                # should group about the same as we
+                                # always group by (domain, code)
+                                "domain": message,
+                                "code": 2,
+                            }
+                        }
+                    },
+                    "stacktrace": thread.get("stacktrace"),
+                }
+            ]
+        }
+    elif get_path(event, "platform") == "cocoa" and get_path(event, "exception", "values", 0, "mechanism", "meta", "ns_error") and not get_path(event, "exception", "values", 0, "stacktrace") and get_path(event, "threads", "values"):
+        # Event the Cocoa 6 events are "crappy" because the
+        # exception contains no stacktrace, instead the thread does
+        #
+        # TODO(markus): Relay should've normalized this
+        threads = event.pop("threads")['values']
+        thread = next((x for x in threads if x.get('current')), threads[0])
+        if thread and thread.get("stacktrace"):
+            event['exception']['values'][0]['stacktrace'] = thread["stacktrace"]
+
+    event.pop('debug_meta', None)
+    event.pop('_ref', None)
+    event.pop('_ref_version', None)
+    event.pop('location', None)
+    event.pop('title', None)
+
+    # make sure the event does not go through minidump processing,
+    # otherwise we get weird errors in the pipeline we have to
+    # ignore
+    exceptions = get_path(event, "exception", "values", filter=True)
+    if exceptions:
+        mechanism = get_path(exceptions, 0, "mechanism", "type")
+
+        if mechanism:
+            set_path(exceptions, 0, "mechanism", "type", value=f"{mechanism}_disabled")
+
+    for stacktrace_info in find_stacktraces_in_data(event):
+        for frame in get_path(stacktrace_info.stacktrace, "frames", filter=True, default=()) or ():
+            orig_in_app = get_path(frame, "data", "orig_in_app")
+            if orig_in_app is not None:
+                frame["in_app"] = None if orig_in_app == -1 else bool(orig_in_app)
+
+    event_id = event.pop('event_id', None)
+    event['tags'] = {"orig_event_id": event_id}
+    event['event_id'] = event_id = str(uuid.uuid4().hex).replace("-", "")
+
+    envelope = Envelope(
+        headers={
+            "event_id": event_id,
+            "sent_at": format_timestamp(datetime.utcnow())
+        }
+    )
+
+    envelope.add_event(event)
+
+    return envelope.serialize()
+
+
+class EnvelopeSender(Sender):
+    """ Posts envelopes to the envelope endpoint of a DSN, shared by all threads
+
+    Unlike the transport of sentry_sdk, this reports the HTTP status, so rate
+    limited envelopes can be retried instead of being dropped silently.
+    """
 
-    if client.transport._disabled_until:
-        print(f"WARNING: Hit rate limits: {client.transport._disabled_until}")
+    #: Seconds to back off after a 429 that does not say for how long
+    DEFAULT_RETRY_AFTER = 60.0
+
+    def __init__(self, dsn: str, num_threads: int):
+        url = urllib3.util.parse_url(dsn)
+        public_key, _, secret_key = (url.auth or "").partition(":")
+        path, _, project_id = (url.path or "").rstrip("/").rpartition("/")
+        if not public_key or not project_id:
+            raise click.BadParameter(f"Invalid DSN {dsn!r}", param_hint="--dsn")
+
+        host = url.host if url.port is None else f"{url.host}:{url.port}"
+        self._url = f"{url.scheme}://{host}{path}/api/{project_id}/envelope/"
+
+        auth = f"Sentry sentry_key={public_key}, sentry_version=7, sentry_client=grouping-tests"
+        if secret_key:
+            auth += f", sentry_secret={secret_key}"
+        self._headers = {
+            "Content-Type": "application/x-sentry-envelope",
+            "Content-Encoding": "gzip",
+            "User-Agent": "grouping-tests",
+            "X-Sentry-Auth": auth,
+        }
+
+        # One connection per thread, the default pool keeps a single one per host
+        self._pool = urllib3.PoolManager(maxsize=num_threads, block=True)
+        self._disabled_until = 0.0  # time.monotonic() up to which events are rate limited
+        self._lock = Lock()
+
+    def send(self, body: bytes) -> int:
+        # The response is read in full, which returns the connection to the pool
+        response = self._pool.request(
+            "POST", self._url, body=gzip.compress(body), headers=self._headers)
+        retry_after = _parse_rate_limits(response.headers, response.status)
+        if retry_after:
+            with self._lock:
+                self._disabled_until = max(self._disabled_until, time.monotonic() + retry_after)
+        return response.status
+
+    def retry_after(self) -> float:
+        return max(0.0, self._disabled_until - time.monotonic())
+
+
+def _parse_rate_limits(headers, status: int) -> float:
+    """ Seconds for which the response says error events are rate limited, 0 if not
+
+    X-Sentry-Rate-Limits is a list of ``retry_after:categories:scope...``
+    limits. A limit without categories applies to all of them.
+    """
+    rate_limits = headers.get("X-Sentry-Rate-Limits")
+    if rate_limits:
+        retry_after = 0.0
+        for limit in rate_limits.split(","):
+            seconds, _, rest = limit.strip().partition(":")
+            categories = rest.split(":", 1)[0]
+            if not categories or "error" in categories.split(";"):
+                try:
+                    retry_after = max(retry_after, float(seconds))
+                except ValueError:
+                    retry_after = max(retry_after, EnvelopeSender.DEFAULT_RETRY_AFTER)
+        return retry_after
+
+    if status == 429:
+        try:
+            return float(headers.get("Retry-After", ""))
+        except ValueError:
+            # Missing, or an HTTP date which Relay does not send
+            return EnvelopeSender.DEFAULT_RETRY_AFTER
+
+    return 0.0
 
 
 def skip_event(event: dict) -> bool:
@@ -3,11 +3,15 @@ configure()
 
 import time
 import click
+from functools import partial
 
+from django.db import close_old_connections
 from sentry.group_deletion import delete_group
 from sentry.models import Project, Group, GroupStatus
 import sentry_sdk
 
+from grouping_tests.wipe import delete_in_chunks, iter_id_chunks
+
 
 sentry_sdk.init("")
 
@@ -18,9 +22,14 @@ StopWorking = "stop_working"
 @click.option("--project-id", type=int, help="the project id to be dumped, alternative to dsn, or (project-slug,org-slug)")
 @click.option("--project-slug", type=str, help="project slug, must also use org-slug, alternatively use project-id or dsn")
 @click.option("--org-slug", type=str, help="organization slug, must also use project-slug, alternatively use project-id or dsn")
-def main( project_id: int, project_slug: str, org_slug: str):
+@click.option("--chunk-size", default=100, help="How many groups to fetch and delete at once")
+@click.option("--num-workers", default=8, help="How many threads to use for deleting")
+def main( project_id: int, project_slug: str, org_slug: str, chunk_size: int, num_workers: int):
     """
    Wipes the project of all messages before starting to send.
+
+   Deleted groups are not fetched again, so an interrupted wipe can be resumed
+   by running it again.
     """
     now = time.time()
 
@@ -28,21 +37,43 @@ def main( project_id: int, project_slug: str, org_slug: str):
         project = Project.objects.get(organization__slug=org_slug, slug=project_slug)
         project_id = project.id
 
-    delete_groups(project_id)
+    delete_groups(project_id, chunk_size, num_workers)
 
     print(f"Done. Elapsed time is {time.time() - now} secs.")
 
 
-def delete_groups(project_id: int):
-    groups = (Group.objects.filter(project_id=project_id).
-              exclude(status__in=[GroupStatus.PENDING_DELETION, GroupStatus.DELETION_IN_PROGRESS]))
+def delete_groups(project_id: int, chunk_size: int = 100, num_workers: int = 8):
+    num_groups = _groups(project_id).count()
+    print(f"Deleting {num_groups} existing groups...")
+
+    chunks = iter_id_chunks(partial(_fetch_group_ids, project_id), chunk_size)
+    with click.progressbar(length=num_groups) as progress_bar:
+        stats = delete_in_chunks(chunks, partial(_delete_group_ids, project_id), num_workers,
+                                 progress_bar.update)
+
+    print(f"{stats}.")
+
+
+def _groups(project_id: int):
+    return (Group.objects.filter(project_id=project_id).
+            exclude(status__in=[GroupStatus.PENDING_DELETION, GroupStatus.DELETION_IN_PROGRESS]))
+
+
+def _fetch_group_ids(project_id: int, after_id: int, limit: int):
+    group_ids = _groups(project_id).filter(id__gt=after_id).order_by("id")
+
+    return list(group_ids.values_list("id", flat=True)[:limit])
+
 
-    groups = list(groups)
-    print(f"Deleting {len(groups)} existing groups...")
+def _delete_group_ids(project_id: int, group_ids):
+    """ Runs in a worker thread, which has a database connection of its own """
+    close_old_connections()
+    num_deleted = 0
+    for group in _groups(project_id).filter(id__in=group_ids):
+        delete_group(group)
+        num_deleted += 1
 
-    with click.progressbar(groups) as groups:
-        for group in groups:
-            delete_group(group)
+    return num_deleted
 
 
 if __name__ == "__main__":